@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# Benchmarks for the win expectancy engine and play replay.
+# Each benchmark is timed call by call and reported as throughput (operations
+# per second), latency percentiles per call and the peak memory allocated
+# while it runs (measured in a second, untimed pass with tracemalloc).
+# Results can be saved as a JSON baseline and compared with a later run.
+#
+# Usage: python Benchmark.py [-o results.json] [--compare baseline.json]
+#            [--quick]
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from Game import GameState, PLAYS, PLAY_INDEX, TRANSITIONS
+from WinExp import WinExpCalculator
+
+# Each benchmark function takes a size multiplier and returns a list of
+# (callable, operations) samples.  Every callable is timed on its own, and
+# operations is how many operations it performs (for throughput).
+
+# constructing a calculator without a shared table cache, then computing
+# getExtrasWin (which construction defers until it is needed)
+def benchConstruct(scale):
+  return [(lambda: WinExpCalculator(4.5,.5,cache=None).extrasWin, 1)
+      for i in range(0,20*scale)]
+
+# the first getWinPct on a fresh calculator, which solves the whole table
+def benchFirstWinPct(scale):
+  samples = []
+  for i in range(0,10*scale):
+    calc = WinExpCalculator(4.5,.5,cache=None)
+    samples.append((lambda calc=calc: calc.getWinPct(1,0,1,0,0), 1))
+  return samples
+
+# getWinPct on random states of an already solved calculator
+def benchWarmWinPct(scale):
+  calc = WinExpCalculator(4.5,.5,eager=True,cache=None)
+  rand = random.Random(1)
+  samples = []
+  for i in range(0,20000*scale):
+    state = (rand.randint(1,8), rand.randint(-10,10), rand.randint(1,12),
+        rand.randint(0,2), rand.randint(0,1))
+    samples.append((lambda state=state: calc.getWinPct(*state), 1))
+  return samples
+
+# getWinPct over every state in the model, on a solved calculator
+def benchSweep(scale):
+  calc = WinExpCalculator(4.5,.5,eager=True,cache=None)
+  def sweep():
+    for inning in range(1,10):
+      for half in range(0,2):
+        for outs in range(0,3):
+          for baseState in range(1,9):
+            for scoreDiff in range(-15,16):
+              calc.getWinPct(baseState,scoreDiff,inning,outs,half)
+  return [(sweep, 9*2*3*8*31) for i in range(0,3*scale)]
+
+# getExptRuns on every base/out state, with its memo cleared before each
+# call (uncached) or warm (cached)
+def benchExptRunsUncached(scale):
+  calc = WinExpCalculator(4.5,.5,cache=None)
+  def call(baseSt, outs):
+    calc.runDists.clear()
+    calc.getExptRuns(baseSt,outs,calc.homeRpi)
+  return [(lambda b=b, o=o: call(b,o), 1) for i in range(0,500*scale)
+      for b in range(1,9) for o in range(0,3)]
+
+def benchExptRunsCached(scale):
+  calc = WinExpCalculator(4.5,.5,cache=None)
+  return [(lambda b=b, o=o: calc.getExptRuns(b,o,calc.homeRpi), 1)
+      for i in range(0,500*scale) for b in range(1,9) for o in range(0,3)]
+
+# GameState.runPlay replay of a synthetic season: 2430 games of 75 random
+# plays each, one sample per game.  Plays are only picked where they are
+# valid, so the replay never hits the invalid play messages.
+def benchReplay(scale):
+  rand = random.Random(2)
+  samples = []
+  for i in range(0,2430*scale):
+    state = GameState()
+    game = []
+    for j in range(0,75):
+      play = rand.choice(PLAYS)
+      while TRANSITIONS[(PLAY_INDEX[play]*3 + state.outs)*8 +
+          state.bases][4] is not None:
+        play = rand.choice(PLAYS)
+      state.runPlay(play)
+      game.append(play)
+    def replay(game=game):
+      state = GameState()
+      for play in game:
+        state.runPlay(play)
+    samples.append((replay, len(game)))
+  return samples
+
+BENCHMARKS = [
+    ("construct", benchConstruct),
+    ("first_getWinPct", benchFirstWinPct),
+    ("warm_getWinPct", benchWarmWinPct),
+    ("state_space_sweep", benchSweep),
+    ("getExptRuns_uncached", benchExptRunsUncached),
+    ("getExptRuns_cached", benchExptRunsCached),
+    ("replay_season", benchReplay),
+    ]
+
+# returns the p-th percentile (0-100) of a sorted list
+def percentile(values,p):
+  return values[min(len(values)-1, int(len(values)*p/100))]
+
+# runs one benchmark and returns its results as a dict
+def runBenchmark(bench,scale):
+  samples = bench(scale)
+  latencies = []
+  ops = 0
+  clock = time.perf_counter_ns
+  for call, count in samples:
+    start = clock()
+    call()
+    latencies.append(clock() - start)
+    ops += count
+  total = sum(latencies)/1e9
+  latencies.sort()
+  #second pass for memory, since tracemalloc slows everything down
+  samples = bench(scale)
+  tracemalloc.start()
+  for call, count in samples:
+    call()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return {
+      "calls": len(latencies),
+      "ops": ops,
+      "seconds": total,
+      "ops_per_sec": ops/total if total else float("inf"),
+      "p50_us": percentile(latencies,50)/1000,
+      "p90_us": percentile(latencies,90)/1000,
+      "p99_us": percentile(latencies,99)/1000,
+      "max_us": latencies[-1]/1000,
+      "peak_kib": peak/1024,
+      }
+
+# prints a comparison of two sets of results
+def compare(old,new):
+  print("%-22s %14s %14s %8s %10s %10s" % ("benchmark", "old ops/s",
+      "new ops/s", "speedup", "old p50us", "new p50us"))
+  for name in new:
+    if name not in old:
+      continue
+    o = old[name]
+    n = new[name]
+    print("%-22s %14.1f %14.1f %7.2fx %10.2f %10.2f" % (name, o["ops_per_sec"],
+        n["ops_per_sec"], n["ops_per_sec"]/o["ops_per_sec"], o["p50_us"],
+        n["p50_us"]))
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Benchmark the win expectancy engine and play replay")
+  parser.add_argument("-o", "--output", help="save results as JSON")
+  parser.add_argument("--compare", help="JSON results to compare against")
+  parser.add_argument("--quick", action="store_true",
+      help="run smaller benchmarks")
+  parser.add_argument("--only", action="append",
+      help="run only the named benchmark (may be repeated)")
+  args = parser.parse_args(argv)
+  scale = 1 if args.quick else 5
+  results = {}
+  print("%-22s %14s %10s %10s %10s %10s" % ("benchmark", "ops/s", "p50us",
+      "p90us", "p99us", "peakKiB"))
+  for name, bench in BENCHMARKS:
+    if args.only and name not in args.only:
+      continue
+    r = runBenchmark(bench,scale)
+    results[name] = r
+    print("%-22s %14.1f %10.2f %10.2f %10.2f %10.1f" % (name, r["ops_per_sec"],
+        r["p50_us"], r["p90_us"], r["p99_us"], r["peak_kib"]))
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump({
+          "python": sys.version,
+          "platform": platform.platform(),
+          "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+          "scale": scale,
+          "results": results,
+          }, f, indent=2)
+  if args.compare:
+    with open(args.compare) as f:
+      old = json.load(f)["results"]
+    print()
+    compare(old,results)
+
+if __name__ == "__main__":
+  main()
@@ -1,92 +1,135 @@
+import contextlib
+import io
+from StateCode import encodeState, HOME_WIN_CODE, VISITOR_WIN_CODE
+
 # This class stores information about the state of a baseball game.
 # Information stored:
 #       Inning
 #       Inning half
 #       Outs
 #       Score (home score, visitor score)
-#       Baserunners - boolean value per base
+#       Baserunners - a 3 bit mask; bit 0 is 1st base, bit 1 2nd, bit 2 3rd
+#       Whether a play has ended the game (set by runPlay; see isGameOver)
 #       
 # It also includes functions to perform basic plays on that game state.
+# Millions of these are created by replays and simulations, so the class
+# uses __slots__ and keeps its play table at class level.
 class GameState():
+  __slots__ = ("inning", "half", "hScore", "vScore", "outs", "bases", "over")
+
   #initialize to the beginning of a game; top of the first
   def __init__(self):
     self.inning = 1
     self.half = 0
     self.hScore = 0
     self.vScore = 0
-    self.base = []
-    for i in range(0,3):
-      self.base.append(False)
+    self.bases = 0
     self.outs = 0
-    self.playDict = {
-        "Strike Out": self.playK,
-        "Walk": self.playBB,
-        "Ground Out": self.playGO,
-        "Fly Out": self.playFO,
-        "Sac Fly": self.playSF,
-        "Double Play": self.playDP,
-        "Stolen Base": self.playSB,
-        "Single": self.play1B,
-        "Double": self.play2B,
-        "Triple": self.play3B,
-        "Home Run": self.playHR
-        }
-
-  # returns an integer code (1-8) representing a base runner configuration
-  def getBaseState(self):
-    #bases empty:
-    if (not self.base[0]  and not self.base[1] and not self.base[2]):
-      return 1
-    #1st:
-    elif (self.base[0] and not self.base[1] and not self.base[2]):
-      return 2
-    #2nd:
-    elif (not self.base[0] and self.base[1] and not self.base[2]):
-      return 3
-    #1st, 2nd:
-    elif (self.base[0] and self.base[1] and not self.base[2]):
-      return 4
-    #3rd:
-    elif (not self.base[0] and not self.base[1] and self.base[2]):
-      return 5
-    #1st, 3rd:
-    elif (self.base[0] and not self.base[1] and self.base[2]):
-      return 6
-    #2md, 3rd:
-    elif (not self.base[0] and self.base[1] and self.base[2]):
-      return 7
-    #bases loaded
-    elif (self.base[0] and self.base[1] and self.base[2]):
-      return 8
+    self.over = False
+
+  # returns a new GameState equal to this one
+  def copy(self):
+    state = GameState.__new__(GameState)
+    state.inning = self.inning
+    state.half = self.half
+    state.hScore = self.hScore
+    state.vScore = self.vScore
+    state.bases = self.bases
+    state.outs = self.outs
+    state.over = self.over
+    return state
+
+  # returns a tuple of every field, used for comparing and hashing states
+  def key(self):
+    return (self.inning, self.half, self.hScore, self.vScore, self.outs,
+        self.bases, self.over)
+
+  def __eq__(self, other):
+    if not isinstance(other, GameState):
+      return NotImplemented
+    return self.key() == other.key()
+
+  def __hash__(self):
+    return hash(self.key())
+
+  # the runners as a tuple of 3 booleans (1st, 2nd, 3rd); use setBase to
+  # change them
+  @property
+  def base(self):
+    return (bool(self.bases & 1), bool(self.bases & 2), bool(self.bases & 4))
+
+  # puts a runner on (or takes one off) a base
+  # i: 0 for 1st base, 1 for 2nd, 2 for 3rd
+  def setBase(self, i, occupied):
+    if occupied:
+      self.bases |= 1 << i
     else:
-      return 0
+      self.bases &= ~(1 << i)
+
+  # returns an integer code (1-8) representing a base runner configuration:
+  # 1 bases empty, 2 1st, 3 2nd, 4 1st and 2nd, 5 3rd, 6 1st and 3rd,
+  # 7 2nd and 3rd, 8 bases loaded
+  def getBaseState(self):
+    return self.bases + 1
+
+  # returns the StateCode integer for this state, as used to index win
+  # expectancy tables.  A game that is over gets the code of the team that
+  # won it.
+  def getStateCode(self):
+    if self.over:
+      return HOME_WIN_CODE if self.hScore > self.vScore else VISITOR_WIN_CODE
+    return encodeState(self.bases + 1, self.hScore - self.vScore,
+        self.inning, self.outs, self.half)
   
-  #finds a play in the dictionary and calls the corresponding class function
+  # returns the message runPlay prints for a play that is not valid in this
+  # state (such as a double play with the bases empty), or None if it is
+  # valid.  runPlay leaves the state unchanged for an invalid play.
+  def checkPlay(self, play):
+    if not 0 <= self.outs <= 2:
+      return None
+    return TRANSITIONS[(PLAY_INDEX[play]*3 + self.outs)*8 + self.bases][4]
+
+  #finds a play in the transition table and applies it to the state
   def runPlay(self, play):
     try:
-      funct = self.playDict[play]
+      playIndex = PLAY_INDEX[play]
     except KeyError:
       print("Play not found in dictionary...")
       return 
-    funct()
+    if not 0 <= self.outs <= 2:
+      #not a state the table covers; fall back on the play's function
+      self.playDict[play](self)
+      return
+    newBases, newOuts, runs, ended, message = \
+        TRANSITIONS[(playIndex*3 + self.outs)*8 + self.bases]
+    if message is not None:
+      print(message)
+    if runs:
+      self.score(runs)
+    self.bases = newBases
+    self.outs = newOuts
+    if ended:
+      self.inning += self.half%2
+      self.half = (self.half+1)%2
+    if not self.over:
+      self.over = isGameOver(self.inning, self.half,
+          self.hScore - self.vScore, ended)
   
   #Strikeout
   def playK(self):
     self.outs += 1
     self.out3Check()
   
-  #Walk
+  #Walk: only forced runners advance
   def playBB(self):
-    if self.base[0]:
-      if self.base[1]:
-        if self.base[2]:
-          self.score(1)
-        else:
-          self.base[2] = True
-      else:
-        self.base[1] = True
+    if not self.bases & 1:
+      self.bases |= 1
+    elif not self.bases & 2:
+      self.bases |= 2
+    elif not self.bases & 4:
+      self.bases |= 4
     else:
-      self.base[0] = True
+      self.score(1)
   
   #Ground out: runners advance
   def playGO(self):
@@ -103,7 +146,7 @@ class GameState():
   #Sacrifice Fly: 
   #  A runner from 2nd base will advance, a runner on 1st will not
   def playSF(self):
-    if self.base[2]==False and self.base[1]==False:
+    if not self.bases & 6:
       print("SF not valid (baserunners)")
       return
     if self.outs == 2:
@@ -111,13 +154,12 @@ class GameState():
       return
     self.outs += 1
     self.advAllRunners()
-    if self.base[1] == True:
-      self.base[1] = False
-      self.base[0] = True
+    if self.bases & 2:
+      self.bases ^= 3
   
   #Double Play: trailing runner is out, others advance
   def playDP(self):
-    if self.getBaseState()==1:
+    if not self.bases:
       print("DP not valid (no baserunners)")
       return
     if self.outs == 2:
@@ -126,12 +168,7 @@ class GameState():
     self.outs += 2
     #trailing runner is thrown out, other runners advance
     if self.outs == 2:
-      if self.base[0]:
-        self.base[0] = False
-      elif self.base[1]:
-        self.base[1] = False
-      elif self.base[2]:
-        self.base[2] = False
+      self.bases &= self.bases - 1
       self.advAllRunners()
     self.out3Check()
   
@@ -142,19 +179,19 @@ class GameState():
   #Single
   def play1B(self):
     self.advAllRunners()
-    self.base[0] = True
+    self.bases |= 1
   
   #double
   def play2B(self):
     for i in range(0,2):
       self.advAllRunners()
-    self.base[1] = True
+    self.bases |= 2
   
   #tripple
   def play3B(self):
     for i in range(0,3):
       self.advAllRunners()
-    self.base[2] = True
+    self.bases |= 4
   
   #Home run
   def playHR(self):
@@ -168,16 +205,13 @@ class GameState():
       self.outs = 0
       self.inning += self.half%2
       self.half = (self.half+1)%2
-      for i in range(0,3):
-        self.base[i] = False
+      self.bases = 0
   
   #advance each baserunner 1 base, 3rd base scores, 1st base left empty
   def advAllRunners(self):
-    if self.base[2]:
+    if self.bases & 4:
       self.score(1)
-    self.base[2] = self.base[1]
-    self.base[1] = self.base[0]
-    self.base[0] = False
+    self.bases = (self.bases << 1) & 7
 
   #scores a number of runs, crediting the correct team based on half
   def score(self,score):
@@ -187,3 +221,61 @@ class GameState():
       self.hScore += score
     else:
       print("GameState bad half: " + str(self.half))
+
+  # plays by name, shared by every GameState
+  playDict = {
+      "Strike Out": playK,
+      "Walk": playBB,
+      "Ground Out": playGO,
+      "Fly Out": playFO,
+      "Sac Fly": playSF,
+      "Double Play": playDP,
+      "Stolen Base": playSB,
+      "Single": play1B,
+      "Double": play2B,
+      "Triple": play3B,
+      "Home Run": playHR
+      }
+
+# returns True if a play that leaves the game in a state ends it: the home
+# team leads in the bottom of the 9th or later (including when the top of
+# the 9th ends with the home team ahead), or the play ended the bottom of
+# the 9th or later with the visitors ahead.  ended is whether the play ended
+# a half inning; a visitors' lead at the start of a top half can also come
+# from a live extra inning (a leadoff home run in the top of the 10th).
+# Variables:
+#  inning, half: inning and half after the play
+#  scoreDiff: number of runs the home team leads by after the play
+#  ended: True if the play ended a half inning
+def isGameOver(inning, half, scoreDiff, ended):
+  if half == 1:
+    return inning >= 9 and scoreDiff > 0
+  return ended and inning >= 10 and scoreDiff < 0
+
+# Play transition table
+# Every play only depends on the runners and the number of outs, so its
+# effect is precomputed for every (play, bases, outs) by running the play
+# functions above on a scratch state.  Entries are tuples of
+#   (new bases mask, new outs, runs scored, half inning ended, message)
+# where message is what the play printed (for invalid plays), or None.
+# The entry for a play is at TRANSITIONS[(PLAY_INDEX[play]*3 + outs)*8 + bases]
+PLAYS = tuple(GameState.playDict)
+PLAY_INDEX = dict((play, i) for i, play in enumerate(PLAYS))
+
+def buildTransitions():
+  transitions = []
+  for play in PLAYS:
+    for outs in range(0,3):
+      for bases in range(0,8):
+        state = GameState()
+        state.bases = bases
+        state.outs = outs
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+          GameState.playDict[play](state)
+        message = out.getvalue().rstrip("\n") or None
+        transitions.append((state.bases, state.outs, state.vScore,
+            state.half == 1, message))
+  return transitions
+
+TRANSITIONS = buildTransitions()
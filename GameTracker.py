@@ -0,0 +1,58 @@
+from array import array
+from Game import GameState
+
+# This class follows one live game, without any GUI.  Each play is applied to
+# the game's GameState and the new win expectancy is read from the
+# calculator's solved table, so an event costs the same whatever the score or
+# inning.  The home team's win% after every event is kept in a compact array
+# of doubles, starting with the win% before the first play.  Once a play
+# ends the game (see Game.isGameOver), the win% is 0 or 1 and no more plays
+# are accepted.
+class GameTracker:
+
+  # calc: WinExpCalculator for the game
+  # state: GameState to start from (a new game by default)
+  # winPct: win% of state, if it is already known
+  def __init__(self,calc,state=None,winPct=None):
+    self.calc = calc
+    if state is None:
+      state = GameState()
+    self.state = state
+    if winPct is None:
+      winPct = calc.getWinPctByCode(state.getStateCode())
+    self.history = array('d', [winPct])
+
+  # the home team's current win%
+  @property
+  def winPct(self):
+    return self.history[-1]
+
+  # the change in the home team's win% from the last event
+  @property
+  def lastChange(self):
+    if len(self.history) < 2:
+      return 0.0
+    return self.history[-1] - self.history[-2]
+
+  # runs a play (a name from GameState.playDict) and records the new win%
+  # returns (winPct, change in winPct)
+  def applyPlay(self,play):
+    if play not in self.state.playDict:
+      raise ValueError("unknown play " + repr(play))
+    if self.state.over:
+      raise ValueError("the game is over")
+    self.state.runPlay(play)
+    return self.refresh()
+
+  # records the win% after the state was changed directly (for example, to
+  # jump to a given inning and score); returns (winPct, change in winPct)
+  # A game that was over is still treated as over unless state.over is
+  # cleared as well.
+  def refresh(self):
+    return self.record(self.calc.getWinPctByCode(self.state.getStateCode()))
+
+  # records the win% of the current state when it was computed elsewhere
+  # (for example, on a background thread); returns (winPct, change in winPct)
+  def record(self,winPct):
+    self.history.append(winPct)
+    return winPct, winPct - self.history[-2]
@@ -1,10 +1,16 @@
+import threading
 from tkinter import *
 from Game import GameState
+from GameTracker import GameTracker
 from WinExp import WinExpCalculator
 
+# milliseconds between checks for a win% computed in the background
+POLL_MS = 20
+
 # This class provides a visible display of the game's win% as a tk widget
 # It is extended from the Canvas widget, and uses the built in drawing
-# functions from that class
+# functions from that class.  Its canvas items are created once and then
+# only moved, so redrawing costs the same however long the app runs.
 class WinBar(Canvas):
   
   # Initializer function
@@ -19,38 +25,139 @@ class WinBar(Canvas):
     self.vColor = vColor
     self.prevWin = var
     self.lastChange = 0
+    #background, bar display and change arrow
+    self.create_rectangle(0,0,402,102,fill='#E4E4E4')
+    self.homeLine = self.create_line(3,25,3,25,width=12,fill=hColor)
+    self.visLine = self.create_line(3,25,399,25,width=12,fill=vColor)
+    self.divider = self.create_line(3,0,3,50,fill='black')
+    self.arrow = []
+    for i in range(0,3):
+      self.arrow.append(self.create_line(0,0,0,0,width=2,state=HIDDEN))
     self.update(var)
   
   # Updates the widget
   # var: value 0-100 to update the display to
   def update(self,var):
-    #erases previous drawing
-    self.create_rectangle(0,0,402,102,fill='#E4E4E4')
-    
     #position in pixels of the dividing point
     posPix = 396*var/100 + 3
-    #draw bar display
-    self.create_line(3,25,posPix,25,width=12,fill=self.hColor)
-    self.create_line(posPix,25,399,25,width=12,fill=self.vColor)
-    self.create_line(posPix,0,posPix,50,fill='black')
+    #move bar display
+    self.coords(self.homeLine,3,25,posPix,25)
+    self.coords(self.visLine,posPix,25,399,25)
+    self.coords(self.divider,posPix,0,posPix,50)
     
     #previous position
     prevPix = 396*self.prevWin/100 + 3
-    #draw arrow if significant change:
+    #show arrow if significant change:
+    color = None
     if (var - self.prevWin) > 1:
       aPix = posPix - (posPix-prevPix)/4
-      self.create_line(prevPix, 42, posPix, 42, width=2, fill=self.hColor)
-      self.create_line(aPix, 35, posPix, 42, width=2, fill=self.hColor)
-      self.create_line(aPix, 49, posPix, 42, width=2, fill=self.hColor)
+      color = self.hColor
     if (self.prevWin - var) > 1:
       aPix = posPix + (prevPix-posPix)/4
-      self.create_line(prevPix, 42, posPix, 42, width=2, fill=self.vColor)
-      self.create_line(aPix, 35, posPix, 42, width=2, fill=self.vColor)
-      self.create_line(aPix, 49, posPix, 42, width=2, fill=self.vColor)
+      color = self.vColor
+    if color is None:
+      for line in self.arrow:
+        self.itemconfigure(line, state=HIDDEN)
+    else:
+      self.coords(self.arrow[0], prevPix, 42, posPix, 42)
+      self.coords(self.arrow[1], aPix, 35, posPix, 42)
+      self.coords(self.arrow[2], aPix, 49, posPix, 42)
+      for line in self.arrow:
+        self.itemconfigure(line, fill=color, state=NORMAL)
     
     self.lastChange = var - self.prevWin
     self.prevWin = var
 
+# This class draws the home team's win% over the whole game as a line chart
+# It is extended from the Canvas widget.  Each call to refresh only adds the
+# segments for events it has not drawn yet; when the chart fills up, the
+# segments already drawn are squeezed to half their width in place.
+class WinChart(Canvas):
+
+  # Initializer function
+  # Variables:
+  #  master: tk master widget
+  #  hColor: home color, used while the home team is favored
+  #  vColor: visitor color, used while the visitors are favored
+  def __init__(self,master,hColor,vColor,width=400,height=100):
+    Canvas.__init__(self,master,width=width,height=height,bg='#E4E4E4')
+    self.hColor = hColor
+    self.vColor = vColor
+    self.chartWidth = width - 6
+    self.chartHeight = height - 6
+    self.create_line(3,3 + self.chartHeight/2,width-3,3 + self.chartHeight/2,
+        fill='gray',dash=(2,2))
+    self.clear()
+
+  # removes every segment
+  def clear(self):
+    self.delete("segment")
+    self.drawn = 1
+    self.step = 8.0
+
+  # returns the canvas position of event i with win% p (0-1)
+  def point(self,i,p):
+    return 3 + i*self.step, 3 + (1-p)*self.chartHeight
+
+  # draws any events in history (a sequence of home win%s, 0-1) that have not
+  # been drawn yet
+  def refresh(self,history):
+    if len(history) < self.drawn:
+      #a new game was started
+      self.clear()
+    while self.drawn < len(history):
+      i = self.drawn
+      if i*self.step > self.chartWidth:
+        self.scale("segment",3,0,.5,1)
+        self.step /= 2
+        continue
+      x0, y0 = self.point(i-1,history[i-1])
+      x1, y1 = self.point(i,history[i])
+      color = self.hColor if history[i] >= .5 else self.vColor
+      self.create_line(x0,y0,x1,y1,fill=color,width=2,tags="segment")
+      self.drawn += 1
+
+# This class computes win expectancies on a background thread, so that a
+# solve never blocks the Tk main loop.  Only the newest request is kept: one
+# that has not been started when a newer one arrives is dropped.
+class WinProbWorker:
+
+  # calc: WinExpCalculator to compute with
+  def __init__(self,calc):
+    self.calc = calc
+    self.cond = threading.Condition()
+    self.lastId = 0
+    self.request = None
+    self.result = None
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  # asks for the win% of a state code; returns the id of the request
+  def submit(self,code):
+    with self.cond:
+      self.lastId += 1
+      self.request = (self.lastId, code)
+      self.cond.notify()
+      return self.lastId
+
+  # returns the newest (request id, win%) result not yet polled, or None
+  def poll(self):
+    with self.cond:
+      result = self.result
+      self.result = None
+      return result
+
+  def run(self):
+    while True:
+      with self.cond:
+        while self.request is None:
+          self.cond.wait()
+        requestId, code = self.request
+        self.request = None
+      winPct = self.calc.getWinPctByCode(code)
+      with self.cond:
+        self.result = (requestId, winPct)
+
 # This class provides the GUI and manages data flow between the other classes
 class App(Frame):
   def __init__(self,master=None):
@@ -59,12 +166,18 @@ class App(Frame):
     self.hColor = "blue"
     self.vColor = "maroon"
 
-    #stores information about the game
-    self.gameState = GameState()
     #used to calculate win expectancy
     #Run Environment: 4.5
     #Home Team Win %: .5
     self.winCalc = WinExpCalculator(4.5,.5)
+    #computes win expectancy until the calculator's table is solved
+    self.worker = WinProbWorker(self.winCalc)
+    #id of the worker request being waited for, if any
+    self.pendingProb = None
+    #stores information about the game
+    self.gameState = GameState()
+    #follows the game's win expectancy; created once the first win% is known
+    self.tracker = None
     
     self.createWidgets()
     self.updateGameDisplay()
@@ -103,6 +216,7 @@ class App(Frame):
     #win probability
     self.winFrm = Frame(self.gameFrm)
     self.wBar = WinBar(self.winFrm,self.hColor,self.vColor)
+    self.chart = WinChart(self.winFrm,self.hColor,self.vColor)
     self.innLbl = Label(self.winFrm)
     self.innTxt = StringVar()
     self.innLbl["textvariable"] = self.innTxt
@@ -113,6 +227,7 @@ class App(Frame):
     self.playTxt = StringVar()
     self.playLbl["textvariable"] = self.playTxt
     self.wBar.pack(side=TOP)
+    self.chart.pack(side=TOP)
     self.innLbl.pack(side=TOP)
     self.baseLbl.pack(side=TOP)
     self.playLbl.pack(side=TOP)
@@ -217,11 +332,13 @@ class App(Frame):
       self.gameState.half = 0
     else:
       print("Bad inning half value: " + halfStr)
+    #a state entered by hand is always a game in progress
+    self.gameState.over = False
     for i in range(0,3):
       if self.baseInt[i].get() == 1:
-        self.gameState.base[i] = True
+        self.gameState.setBase(i,True)
       elif self.baseInt[i].get() == 0:
-        self.gameState.base[i] = False
+        self.gameState.setBase(i,False)
       else:
         print("Bad base checkbox value: " + str(self.baseInt[i].get()))
     self.updateGameDisplay()
@@ -233,23 +350,63 @@ class App(Frame):
     self.updateGameDisplay()
     self.updateStateDisplay()
 
+  # Asks for the win% of the current state.  Once the calculator's table is
+  # solved this is an instant lookup; until then the state goes to the
+  # background worker, and the last known win% stays on display until
+  # pollProb picks up the result.  Results for states the game has already
+  # moved past are dropped.
+  def requestProb(self):
+    code = self.gameState.getStateCode()
+    if self.winCalc.table is not None:
+      self.pendingProb = None
+      self.showProb(self.winCalc.getWinPctByCode(code))
+      return
+    if self.pendingProb is None:
+      self.after(POLL_MS, self.pollProb)
+    self.pendingProb = self.worker.submit(code)
+
+  # checks for the worker's answer to the latest request
+  def pollProb(self):
+    if self.pendingProb is None:
+      return
+    result = self.worker.poll()
+    if result is not None and result[0] == self.pendingProb:
+      self.pendingProb = None
+      self.showProb(result[1])
+    else:
+      self.after(POLL_MS, self.pollProb)
+
+  # records the win% (0-1) of the current state and displays it
+  def showProb(self,winPct):
+    if self.tracker is None:
+      self.tracker = GameTracker(self.winCalc,self.gameState,winPct)
+    else:
+      self.tracker.record(winPct)
+    self.updateProb()
+
+    # Win % change display
+    lc = int(round(self.wBar.lastChange, 0))
+    playTxt = "Last W% Change: "
+    if lc > 0:
+      playTxt += "Home +" + str(lc) + "%"
+    elif lc < 0:
+      playTxt += "Visitor +" + str(-1*lc) + "%"
+    else:
+      playTxt += "Change < 1%"
+    self.playTxt.set(playTxt)
+
   #updates the win probabilities displayed
   def updateProb(self):
     prob = self.getWinProb()
     self.wBar.update(prob)
+    self.chart.refresh(self.tracker.history)
     prob = int(round(prob, 0))
     self.homePctTxt.set("Win Pct: " + str(prob) + "%")
     self.visPctTxt.set("Win Pct: " + str(100-prob) + "%")
   
-  # Simple function to call getWinPct with the correct arguments
+  # Returns the home team's current win%, 0-100
   def getWinProb(self):
-    p = self.winCalc.getWinPct(
-        self.gameState.getBaseState(),
-        self.gameState.hScore - self.gameState.vScore,
-        self.gameState.inning,
-        self.gameState.outs,
-        self.gameState.half)
-    return p*100
+    return self.tracker.winPct*100
 
   # Updates the display of the state of the game (top) 
   def updateGameDisplay(self):
@@ -298,42 +455,19 @@ class App(Frame):
         self.visScoreTxt.set("Visitor " + str(vScore))
     
     # Updates win probability and sets win % displays
-    self.updateProb()
-
-    # Win % change display
-    lc = int(round(self.wBar.lastChange, 0))
-    playTxt = "Last W% Change: "
-    if lc > 0:
-      playTxt += "Home +" + str(lc) + "%"
-    elif lc < 0:
-      playTxt += "Visitor +" + str(-1*lc) + "%"
-    else:
-      playTxt += "Change < 1%"
-    self.playTxt.set(playTxt)
+    self.requestProb()
 
   # Updates the "Go to specific game state" section to follow the actual
   # game state
   def updateStateDisplay(self):
-    while self.gameState.inning > int(self.innEnter.get()):
-      self.innEnter.invoke('buttonup')
-    while self.gameState.inning < int(self.innEnter.get()):
-      self.innEnter.invoke('buttondown')
+    self.setSpinbox(self.innEnter, self.gameState.inning)
     if self.gameState.half == 0:
-      self.halfEnter.invoke('buttonup')
+      self.setSpinbox(self.halfEnter, "Top")
     else:
-      self.halfEnter.invoke('buttondown')
-    while self.gameState.outs > int(self.outEnter.get()):
-      self.outEnter.invoke('buttonup')
-    while self.gameState.outs < int(self.outEnter.get()):
-      self.outEnter.invoke('buttondown')
-    while self.gameState.hScore > int(self.hEnter.get()):
-      self.hEnter.invoke('buttonup')
-    while self.gameState.hScore < int(self.hEnter.get()):
-      self.hEnter.invoke('buttondown')
-    while self.gameState.vScore > int(self.vEnter.get()):
-      self.vEnter.invoke('buttonup')
-    while self.gameState.vScore < int(self.vEnter.get()):
-      self.vEnter.invoke('buttondown')
+      self.setSpinbox(self.halfEnter, "Bottom")
+    self.setSpinbox(self.outEnter, self.gameState.outs)
+    self.setSpinbox(self.hEnter, self.gameState.hScore)
+    self.setSpinbox(self.vEnter, self.gameState.vScore)
     for i in range(0,3):
       if self.gameState.base[i] == True:
         self.baseCh[i].select()
@@ -341,3 +475,7 @@ class App(Frame):
         self.baseCh[i].deselect()
     return
 
+  # Replaces the text of a Spinbox with a value
+  def setSpinbox(self,box,value):
+    box.delete(0, END)
+    box.insert(0, str(value))
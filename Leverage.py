@@ -0,0 +1,170 @@
+# What-if evaluation of every possible next play from a game state, and the
+# leverage that follows from it.  Instead of copying a GameState and asking
+# for a fresh win% once per play, every branch is read straight out of the
+# play transition table (Game.TRANSITIONS) and the calculator's solved table.
+#
+# leverage: the average absolute change in the home team's win% over the
+#     next play, with every valid play counted equally unless weights (for
+#     example, how often each play happens) are given
+# relative leverage: leverage relative to the leverage of the first plate
+#     appearance of a game (top of the 1st, tied, bases empty, no outs).
+#     This is not the standard leverage index, which is relative to the
+#     average leverage over all the plate appearances of real games.  It is
+#     NaN when weights leave the first plate appearance with no leverage
+#     (for example, weights that only count double plays).
+# Plays that are not valid in a state, or that would not change it (a stolen
+# base with the bases empty), are not counted.  A play that ends the game
+# (see Game.isGameOver) leads to a win% of 0 or 1.
+import math
+from Game import PLAYS, PLAY_INDEX, TRANSITIONS, isGameOver
+from StateCode import encodeState, MAX_DIFF, NUM_DIFFS, HOME_WIN_CODE, \
+    VISITOR_WIN_CODE
+
+# returns True if a transition table entry is a play that is valid, and
+# changes the state, from the state it is for
+def isBranch(transition,outs,bases):
+  newBases, newOuts, runs, ended, message = transition
+  return message is None and (ended or runs > 0 or newBases != bases or
+      newOuts != outs)
+
+# returns the post-play win% of every valid play from a state, as a dict
+# keyed by play name.  Plays that are not valid in the state (such as a
+# double play with the bases empty), or that do not change it, are left out.
+# The game state variables are the same as in WinExpCalculator.getWinPct
+def getBranches(calc,baseState,scoreDiff,inning,outs,half):
+  branches = {}
+  for play in PLAYS:
+    transition = TRANSITIONS[(PLAY_INDEX[play]*3 + outs)*8 + baseState-1]
+    if not isBranch(transition,outs,baseState-1):
+      continue
+    newBases, newOuts, runs, ended, message = transition
+    newDiff = scoreDiff + runs if half == 1 else scoreDiff - runs
+    newInning = inning
+    newHalf = half
+    if ended:
+      newInning += half
+      newHalf = 1 - half
+    if isGameOver(newInning,newHalf,newDiff,ended):
+      code = HOME_WIN_CODE if newDiff > 0 else VISITOR_WIN_CODE
+    else:
+      code = encodeState(newBases+1,newDiff,newInning,newOuts,newHalf)
+    branches[play] = calc.getWinPctByCode(code)
+  return branches
+
+# returns the weighted average absolute change from preWin over branches
+def averageSwing(preWin,branches,weights):
+  total = 0
+  weightSum = 0
+  for play, postWin in branches.items():
+    weight = 1 if weights is None else weights.get(play,0)
+    total += weight*abs(postWin - preWin)
+    weightSum += weight
+  if weightSum == 0:
+    return 0
+  return total/weightSum
+
+# returns (preWin, branches, leverage, relativeLeverage) for one game state
+# Variables:
+#  calc: WinExpCalculator
+#  baseState, scoreDiff, inning, outs, half: the game state, as in getWinPct
+#  weights: optional dict of relative weights per play name; plays missing
+#      from it are not counted
+def getLeverage(calc,baseState,scoreDiff,inning,outs,half,weights=None):
+  preWin = calc.getWinPct(baseState,scoreDiff,inning,outs,half)
+  branches = getBranches(calc,baseState,scoreDiff,inning,outs,half)
+  leverage = averageSwing(preWin,branches,weights)
+  return preWin, branches, leverage, relativeLeverage(calc,leverage,weights)
+
+# returns leverage relative to the first plate appearance, or NaN if that
+# has no leverage with these weights
+def relativeLeverage(calc,leverage,weights):
+  first = firstLeverage(calc,weights)
+  if first == 0:
+    return leverage*math.nan
+  return leverage/first
+
+# leverage of the first plate appearance of a game, which relative leverage
+# is measured against
+def firstLeverage(calc,weights):
+  preWin = calc.getWinPct(1,0,1,0,0)
+  return averageSwing(preWin,getBranches(calc,1,0,1,0,0),weights)
+
+# transition table as numpy arrays indexed [play, outs, bases], built on
+# first use by getLeverageBatch
+transitionArrays = None
+
+def getTransitionArrays():
+  global transitionArrays
+  if transitionArrays is None:
+    import numpy as np
+    shape = (len(PLAYS), 3, 8)
+    columns = list(zip(*TRANSITIONS))
+    valid = [isBranch(transition,i//8 % 3,i % 8)
+        for i, transition in enumerate(TRANSITIONS)]
+    transitionArrays = (np.array(columns[0]).reshape(shape),
+        np.array(columns[1]).reshape(shape),
+        np.array(columns[2]).reshape(shape),
+        np.array(columns[3]).reshape(shape),
+        np.array(valid).reshape(shape))
+  return transitionArrays
+
+# getLeverageBatch
+# Vectorized getLeverage for arrays of game states; requires numpy.
+# Arguments are the same as WinExpCalculator.getWinPctBatch, plus weights.
+# Returns (preWin, postWin, leverage, relativeLeverage): preWin, leverage and
+# relativeLeverage have the arguments' broadcast shape, and postWin has that
+# shape plus a last axis with one entry per play (in Game.PLAYS order), NaN
+# where a play is not counted.
+def getLeverageBatch(calc,baseState,scoreDiff=None,inning=None,outs=None,
+    half=None,weights=None):
+  #imported here so that the scalar functions work without numpy
+  import numpy as np
+  if scoreDiff is None:
+    states = baseState
+    baseState = states['baseState']
+    scoreDiff = states['scoreDiff']
+    inning = states['inning']
+    outs = states['outs']
+    half = states['half']
+  #work on flat arrays of states, and give the results the arguments'
+  #broadcast shape at the end
+  baseState, scoreDiff, inning, outs, half = np.broadcast_arrays(
+      *(np.asarray(x, dtype=np.int64) for x in
+      (baseState, scoreDiff, inning, outs, half)))
+  shape = baseState.shape
+  baseState, scoreDiff, inning, outs, half = (x.ravel() for x in
+      (baseState, scoreDiff, inning, outs, half))
+  preWin = calc.getWinPctBatch(baseState,scoreDiff,inning,outs,half)
+  table = np.frombuffer(calc.table, dtype=np.float64)
+  newBases, newOuts, runs, ended, valid = getTransitionArrays()
+  #one row per state, one column per play
+  newBases = newBases[:,outs,baseState-1].T
+  newOuts = newOuts[:,outs,baseState-1].T
+  runs = runs[:,outs,baseState-1].T
+  ended = ended[:,outs,baseState-1].T
+  valid = valid[:,outs,baseState-1].T
+  half = half[:,None]
+  newDiff = scoreDiff[:,None] + np.where(half == 1, runs, -runs)
+  newInning = inning[:,None] + ended*half
+  newHalf = np.where(ended, 1-half, half)
+  #same as isGameOver
+  over = (((newHalf == 1) & (newInning >= 9) & (newDiff > 0)) |
+      (ended & (newHalf == 0) & (newInning >= 10) & (newDiff < 0)))
+  newInning = np.minimum(newInning, 9)
+  codes = ((((newInning-1)*2 + newHalf)*3 + newOuts)*8 + newBases)*NUM_DIFFS \
+      + np.clip(newDiff, -MAX_DIFF, MAX_DIFF) + MAX_DIFF
+  codes[(newDiff > MAX_DIFF) | (over & (newDiff > 0))] = HOME_WIN_CODE
+  codes[(newDiff < -MAX_DIFF) | (over & (newDiff < 0))] = VISITOR_WIN_CODE
+  postWin = np.where(valid, table[codes], np.nan)
+  if weights is None:
+    playWeights = np.ones(len(PLAYS))
+  else:
+    playWeights = np.array([weights.get(play,0) for play in PLAYS], dtype=float)
+  playWeights = valid*playWeights
+  weightSum = playWeights.sum(axis=1)
+  swing = np.where(valid, np.abs(postWin - preWin[:,None]), 0)
+  leverage = np.divide((swing*playWeights).sum(axis=1), weightSum,
+      out=np.zeros(len(preWin)), where=weightSum > 0)
+  return (preWin.reshape(shape), postWin.reshape(shape + (len(PLAYS),)),
+      leverage.reshape(shape),
+      relativeLeverage(calc,leverage,weights).reshape(shape))
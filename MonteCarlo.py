@@ -0,0 +1,117 @@
+# Monte Carlo simulation of the rest of a game, used to cross-check the
+# analytic model in WinExpCalculator.  Each half inning's runs are drawn from
+# the same run distributions the model uses (WinExpCalculator.getExptRuns):
+# the current half inning from the game's base state and outs, every later
+# one from the start of an inning.  Games play on past the 9th until one team
+# is ahead after a full inning, with walk-offs in the bottom half.
+#
+# Unlike the model, the simulation does not stop at a MAX_DIFF run lead and
+# draws from each distribution rescaled to sum to 1, so small differences
+# from getWinPct are expected.
+#
+# Trials are vectorized with numpy, and simulateWinPct can split them over
+# processes.  Every process gets its own child of one numpy SeedSequence, so
+# results only depend on the seed and the number of processes.
+import math
+import multiprocessing
+import numpy as np
+
+# trials simulated per numpy batch, to bound memory use
+BATCH_SIZE = 1 << 20
+
+# innings after which still tied games are given up on (and not counted as
+# home wins); reaching it takes far more extra innings than ever happen
+MAX_INNINGS = 100
+
+# returns the cumulative distribution of runs for a run distribution from
+# getExptRuns, rescaled so it ends at exactly 1
+def cumulative(runPcts):
+  cdf = np.cumsum(np.asarray(runPcts, dtype=np.float64))
+  return cdf/cdf[-1]
+
+# returns everything a simulation needs from the calculator, as plain data
+# that can be sent to worker processes:
+#   (first half inning cdf, visitors' inning cdf, home inning cdf)
+def getDistributions(calc,baseState,outs,half):
+  rpi = calc.homeRpi if half == 1 else calc.visRpi
+  return (cumulative(calc.getExptRuns(baseState,outs,rpi)),
+      cumulative(calc.getExptRuns(1,0,calc.visRpi)),
+      cumulative(calc.getExptRuns(1,0,calc.homeRpi)))
+
+# simulates trials games from one state and returns how many the home team
+# won
+# Variables:
+#  dists: distributions from getDistributions
+#  scoreDiff, inning, half: state of the game (the base state and outs are
+#      already built into the first distribution)
+#  trials: number of games to simulate
+#  rng: numpy Generator to draw from
+def countHomeWins(dists,scoreDiff,inning,half,trials,rng):
+  firstCdf, visCdf, homeCdf = dists
+  wins = 0
+  while trials > 0:
+    n = min(trials, BATCH_SIZE)
+    trials -= n
+    diff = np.full(n, scoreDiff, dtype=np.int64)
+    cdf = firstCdf
+    inn = inning
+    hlf = half
+    while diff.size and inn <= MAX_INNINGS:
+      runs = np.searchsorted(cdf, rng.random(diff.size), side="right")
+      np.minimum(runs, 10, out=runs)
+      if hlf == 0:
+        diff -= runs
+        cdf = homeCdf
+        hlf = 1
+        if inn >= 9:
+          #home team ahead after the top of the 9th or later has won
+          over = diff > 0
+          wins += int(np.count_nonzero(over))
+          diff = diff[~over]
+      else:
+        diff += runs
+        cdf = visCdf
+        hlf = 0
+        inn += 1
+        if inn > 9:
+          #after the bottom of the 9th or later, anyone ahead has won
+          wins += int(np.count_nonzero(diff > 0))
+          diff = diff[diff == 0]
+  return wins
+
+def countHomeWinsWorker(args):
+  dists, scoreDiff, inning, half, trials, seed = args
+  return countHomeWins(dists,scoreDiff,inning,half,trials,
+      np.random.default_rng(seed))
+
+# returns (estimate, low, high): the simulated odds that the home team wins
+# from a game state, and a Wilson score confidence interval around it
+# Variables:
+#  calc: WinExpCalculator whose run distributions are used
+#  state: GameState to simulate from
+#  trials: number of games to simulate
+#  seed: seed for numpy's SeedSequence; None for a fresh random one
+#  processes: number of processes to split the trials over
+#  z: z score of the confidence interval (1.96 for 95%)
+def simulateWinPct(calc,state,trials=1000000,seed=None,processes=1,z=1.96):
+  dists = getDistributions(calc,state.getBaseState(),state.outs,state.half)
+  scoreDiff = state.hScore - state.vScore
+  seeds = np.random.SeedSequence(seed).spawn(processes)
+  jobs = []
+  for i in range(0,processes):
+    share = trials//processes + (1 if i < trials % processes else 0)
+    jobs.append((dists, scoreDiff, state.inning, state.half, share, seeds[i]))
+  if processes == 1:
+    wins = countHomeWinsWorker(jobs[0])
+  else:
+    with multiprocessing.Pool(processes) as pool:
+      wins = sum(pool.map(countHomeWinsWorker, jobs))
+  return wilsonInterval(wins,trials,z)
+
+# returns (estimate, low, high) for wins successes in trials trials
+def wilsonInterval(wins,trials,z):
+  p = wins/trials
+  denom = 1 + z*z/trials
+  center = (p + z*z/(2*trials))/denom
+  spread = z*math.sqrt(p*(1-p)/trials + z*z/(4*trials*trials))/denom
+  return p, center - spread, center + spread
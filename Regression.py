@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# Checks the win expectancy engine and the play transition table against
+# pinned reference results, so that changes to the table solver or the play
+# methods cannot silently change what they compute, and that the win
+# expectancy service answers malformed requests without leaving work behind.
+# The reference win%s were produced by the original recursive getWinPct
+# (with the shipped baseruns_coefficients.csv), which the bottom-up solver
+# reproduces exactly, and compare exact floating point values.  The
+# reference transitions were produced by the original play methods.
+#
+# Usage: python Regression.py
+import asyncio
+import contextlib
+import gc
+import hashlib
+import io
+import random
+import struct
+import sys
+from Game import GameState, PLAYS, PLAY_INDEX, TRANSITIONS
+from WinExp import WinExpCalculator
+from WinExpServer import WinExpService
+
+# (baseState, scoreDiff, inning, outs, half) -> win% at runEnv 4.5, homeWin .5
+PINNED_WIN_PCTS = [
+    ((1, 0, 1, 0, 0), 0.4992252325711915),
+    ((3, 0, 5, 1, 0), 0.4734371129862849),
+    ((8, -1, 9, 2, 1), 0.27180325),
+    ((4, 2, 7, 0, 1), 0.9271142078182598),
+    ((1, -3, 9, 0, 0), 0.03246563410714058),
+    ((5, 1, 3, 2, 0), 0.6280819138925637),
+    ((2, -2, 8, 1, 1), 0.17088341791538855),
+    ]
+
+# (runEnv, homeWin) -> SHA-256 of the whole solved table, as little endian
+# doubles in state code order
+PINNED_TABLES = [
+    ((4.5, .5),
+        "477ac1a0ec6e33ac3896a998b57f67b65e8f728ca2867b835a967d1feaa2b012"),
+    ((3.0, .3),
+        "742ffe4d1f6e81d187d12b091564d5f01d435e4d873758608d7492a04c299159"),
+    ((6.0, .7),
+        "ae00f1b5063bbdf5ed48226b36d2b5c1bcb5a48353b1017ac582458a36ae7da9"),
+    ((4.0, .55),
+        "27f1fe2f63d7680042d91a5f3fdb9993e344e622b5d622e3188ea5804f9973ae"),
+    ((5.0, .45),
+        "7e06e2eaaf3756f6b59a6cfa56b6d04950adc0a13e5c8b29dca3e58ee71264cf"),
+    ((2.5, .6),
+        "54e4ad9e4665d32b3048ae7afbb400a64891d726c3788d7832ba167046c249be"),
+    ]
+
+# (play, outs, bases) -> (newBases, newOuts, runs, ended, message) entries of
+# Game.TRANSITIONS
+PINNED_TRANSITIONS = [
+    (("Single", 0, 4), (1, 0, 1, False, None)),
+    (("Double", 1, 3), (6, 1, 1, False, None)),
+    (("Home Run", 2, 7), (0, 2, 4, False, None)),
+    (("Sac Fly", 1, 4), (0, 2, 1, False, None)),
+    (("Double Play", 0, 1), (0, 2, 0, False, None)),
+    (("Strike Out", 2, 0), (0, 0, 0, True, None)),
+    (("Walk", 0, 7), (7, 0, 1, False, None)),
+    (("Sac Fly", 2, 4), (4, 2, 0, False, "SF not valid (2 outs)")),
+    ]
+
+# SHA-256 of repr(Game.TRANSITIONS)
+PINNED_TRANSITIONS_DIGEST = \
+    "071e26f8ba009a51ff1886428daaa819eb0c7385d05dda60b6b6d6f6e329f3a7"
+
+# requests WinExpService must answer with an error, leaving nothing queued
+BAD_REQUESTS = [
+    [1, 2],
+    {"id": 1, "runEnv": 4.5, "homeWin": .5, "states": 5},
+    {"id": 2, "runEnv": 4.5, "homeWin": .5, "states": [[1, 0, 1, 0]]},
+    {"id": 3, "runEnv": 4.5, "homeWin": .5, "state": 7},
+    {"id": 4, "runEnv": 4.5, "homeWin": 0, "state": [1, 0, 1, 0, 0]},
+    {"id": 5, "runEnv": -1, "homeWin": .5, "state": [1, 0, 1, 0, 0]},
+    ]
+
+# returns the SHA-256 hex digest of a solved table
+def tableDigest(table):
+  return hashlib.sha256(struct.pack('<%dd' % len(table), *table)).hexdigest()
+
+# returns a list of failure messages for the solved tables
+def checkTables():
+  failures = []
+  calc = WinExpCalculator(4.5,.5,cache=None)
+  for state, expected in PINNED_WIN_PCTS:
+    winPct = calc.getWinPct(*state)
+    if winPct != expected:
+      failures.append("getWinPct" + str(state) + " = " + repr(winPct) +
+          ", expected " + repr(expected))
+  for params, expected in PINNED_TABLES:
+    calc = WinExpCalculator(*params,eager=True,cache=None)
+    digest = tableDigest(calc.table)
+    if digest != expected:
+      failures.append("table for runEnv " + str(params[0]) + ", homeWin " +
+          str(params[1]) + " has digest " + digest + ", expected " + expected)
+  return failures
+
+# returns a list of failure messages for the transition table
+def checkTransitions():
+  failures = []
+  for (play, outs, bases), expected in PINNED_TRANSITIONS:
+    entry = TRANSITIONS[(PLAY_INDEX[play]*3 + outs)*8 + bases]
+    if entry != expected:
+      failures.append("transition " + str((play, outs, bases)) + " = " +
+          str(entry) + ", expected " + str(expected))
+  digest = hashlib.sha256(repr(TRANSITIONS).encode()).hexdigest()
+  if digest != PINNED_TRANSITIONS_DIGEST:
+    failures.append("transition table has digest " + digest + ", expected " +
+        PINNED_TRANSITIONS_DIGEST)
+  return failures
+
+# returns a list of failure messages for GameState.runPlay, which reads the
+# transition table, replayed against the play methods on random games
+def checkRunPlay(games=300,plays=150,seed=1):
+  failures = []
+  rng = random.Random(seed)
+  for game in range(0,games):
+    fast = GameState()
+    slow = GameState()
+    for i in range(0,plays):
+      play = rng.choice(PLAYS)
+      fastOut = io.StringIO()
+      with contextlib.redirect_stdout(fastOut):
+        fast.runPlay(play)
+      slowOut = io.StringIO()
+      with contextlib.redirect_stdout(slowOut):
+        GameState.playDict[play](slow)
+      #the play methods do not track whether the game is over
+      if (fast.key()[:-1] != slow.key()[:-1] or
+          fastOut.getvalue() != slowOut.getvalue()):
+        failures.append("game " + str(game) + ", play " + str(i) + " (" +
+            play + "): runPlay gives " + str(fast.key()[:-1]) + " " +
+            repr(fastOut.getvalue()) + ", play method gives " +
+            str(slow.key()[:-1]) + " " + repr(slowOut.getvalue()))
+        break
+  return failures
+
+# returns a list of failure messages for WinExpService's handling of
+# BAD_REQUESTS
+def checkServer():
+  return asyncio.run(checkServerRequests())
+
+async def checkServerRequests():
+  failures = []
+  #errors the event loop logs, such as a future whose exception was never
+  #retrieved
+  loopErrors = []
+  asyncio.get_running_loop().set_exception_handler(
+      lambda loop, context: loopErrors.append(context["message"]))
+  service = WinExpService(batchDelay=0)
+  for request in BAD_REQUESTS:
+    response = await service.handleRequest(request)
+    if "error" not in response:
+      failures.append("request " + str(request) + " got " + str(response))
+  #a good request for the same parameters is still answered
+  state, expected = PINNED_WIN_PCTS[0]
+  response = await service.handleRequest(
+      {"id": 6, "runEnv": 4.5, "homeWin": .5, "state": list(state)})
+  if response.get("winPct") != expected:
+    failures.append("good request got " + str(response))
+  if service.queued:
+    failures.append("requests left queued: " + str(service.queued))
+  gc.collect()
+  for message in loopErrors:
+    failures.append("event loop error: " + message)
+  return failures
+
+CHECKS = [
+    ("tables", checkTables),
+    ("transitions", checkTransitions),
+    ("runPlay", checkRunPlay),
+    ("server", checkServer),
+    ]
+
+def main():
+  failed = False
+  for name, check in CHECKS:
+    failures = check()
+    print("%-12s %s" % (name, "FAILED" if failures else "ok"))
+    for failure in failures:
+      print("  " + failure)
+    failed = failed or bool(failures)
+  return 1 if failed else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,54 @@
+# Canonical integer codes for the game states the win expectancy model
+# distinguishes.  A code packs the base state (1-8), outs (0-2), half (0-1),
+# inning (1-9; later innings are treated as the 9th) and the score difference
+# (-MAX_DIFF..MAX_DIFF) into one mixed radix integer:
+#   ((((inning-1)*2 + half)*3 + outs)*8 + baseState-1)*NUM_DIFFS
+#       + scoreDiff + MAX_DIFF
+# Games that are decided (the home team leads or trails by more than
+# MAX_DIFF) get one of two extra codes, so every code can index directly
+# into a win expectancy table of NUM_CODES entries.
+
+MAX_DIFF = 15
+NUM_DIFFS = 2*MAX_DIFF + 1
+NUM_STATES = 9*2*3*8*NUM_DIFFS
+HOME_WIN_CODE = NUM_STATES
+VISITOR_WIN_CODE = NUM_STATES + 1
+NUM_CODES = NUM_STATES + 2
+
+# returns the code for a game state
+# Variables:
+#  baseState: integers 1-8 designate different base runner configurations
+#  scoreDiff: number of runs that the home team leads by (can be negative)
+#  inning: integer representing inning of play
+#  outs: number of outs; 0-2
+#  half: 0 signifies top of inning, 1 signifies bottom
+def encodeState(baseState,scoreDiff,inning,outs,half):
+  #game is very close to decided:
+  if scoreDiff > MAX_DIFF:
+    return HOME_WIN_CODE
+  if scoreDiff < -MAX_DIFF:
+    return VISITOR_WIN_CODE
+  if not (1 <= baseState <= 8 and 0 <= outs <= 2 and 0 <= half <= 1
+      and inning >= 1):
+    raise ValueError("encodeState: game state out of range")
+  #innings 9 and later are treated the same in this model
+  if inning > 9:
+    inning = 9
+  return ((((inning-1)*2 + half)*3 + outs)*8 + baseState-1)*NUM_DIFFS \
+      + scoreDiff + MAX_DIFF
+
+# returns the (baseState, scoreDiff, inning, outs, half) a code stands for
+# Decided games come back as a bases empty, no out top of the 9th with the
+# score difference just past MAX_DIFF, which encodes to the same code.
+def decodeState(code):
+  if not 0 <= code < NUM_CODES:
+    raise ValueError("decodeState: bad state code " + str(code))
+  if code == HOME_WIN_CODE:
+    return (1, MAX_DIFF+1, 9, 0, 0)
+  if code == VISITOR_WIN_CODE:
+    return (1, -MAX_DIFF-1, 9, 0, 0)
+  code, diff = divmod(code, NUM_DIFFS)
+  code, baseState = divmod(code, 8)
+  code, outs = divmod(code, 3)
+  inning, half = divmod(code, 2)
+  return (baseState+1, diff-MAX_DIFF, inning+1, outs, half)
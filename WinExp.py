@@ -1,10 +1,379 @@
 #!/usr/bin/python
-import sqlite3 as sql;
+import hashlib
 import math;
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+from array import array
+from collections import OrderedDict
+
+from StateCode import (encodeState, MAX_DIFF, NUM_DIFFS, HOME_WIN_CODE,
+    VISITOR_WIN_CODE, NUM_CODES)
+
+# Coefficients for the run distributions of every base/out state, shipped
+# alongside this file, and the name they are registered under
+COEFF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "baseruns_coefficients.csv")
+DEFAULT_COEFFICIENTS = "default"
+
+# Solved tables can be saved to a binary file and memory mapped back in, so
+# that many processes can share one read-only copy.  The file is a fixed size
+# header followed by the table's values in native byte order:
+#   magic, version, byte order marker, MAX_DIFF, number of entries,
+#   runEnv, homeWin, extrasWin, digest of the coefficients solved with,
+#   array typecode of the values, padding to 72 bytes
+# The table is indexed by state code (see StateCode.py).
+TABLE_MAGIC = b'WINEXPTB'
+TABLE_VERSION = 4
+TABLE_BYTE_ORDER = 0x01020304
+TABLE_HEADER = struct.Struct('=8sIIIIddd16sc7x')
+
+# Tables can also be stored as 16 bit fixed point numbers, a quarter of the
+# size of a full table: each win% is stored as the unsigned short
+# round(winPct*QUANT_SCALE) + QUANT_ZERO.  That covers win%s from -1/14 to
+# 1 + 1/14, since the model can overshoot 0 and 1 slightly (by up to about
+# .03 for extreme parameters), and keeps 0 and 1 exact.  Every value is
+# within QUANT_ERROR (about 8.7e-6) of the full precision one.  See
+# QuantizedTable.
+QUANT_SCALE = 57344
+QUANT_ZERO = 4096
+QUANT_ERROR = .5/QUANT_SCALE
+
+# Process wide cache of solved win expectancy tables, shared by every
+# WinExpCalculator with the same parameters.  Entries are keyed by runEnv and
+# homeWin rounded to a number of decimal places, so calculators whose
+# parameters round to the same key share the first table solved for that key,
+# and by the coefficient set (and its generation) the table was solved with.
+# The least recently used table is evicted once there are more than size.
+# The cache is safe to use from many threads, and getOrSolve makes sure a
+# missing table is only solved once however many threads ask for it.
+class TableCache:
+
+  # size: maximum number of solved tables to keep
+  # digits: decimal places runEnv and homeWin are rounded to for the key
+  def __init__(self,size=32,digits=6):
+    self.size = size
+    self.digits = digits
+    self.entries = OrderedDict()
+    #PendingSolve for every key being solved right now
+    self.pending = {}
+    self.lock = threading.RLock()
+
+  # returns the cache key for a pair of parameters
+  # coefficients: CoefficientSet the table is solved with (the default set
+  #     if None)
+  def key(self,runEnv,homeWin,coefficients=None):
+    if coefficients is None:
+      coefficients = getCoefficientSet(DEFAULT_COEFFICIENTS)
+    return (round(runEnv,self.digits), round(homeWin,self.digits),
+        coefficients.name, coefficients.generation)
+
+  # returns the (extrasWin, table) entry stored for key, or None
+  def get(self,key):
+    with self.lock:
+      try:
+        entry = self.entries[key]
+      except KeyError:
+        return None
+      self.entries.move_to_end(key)
+      return entry
+
+  # stores an (extrasWin, table) entry, evicting old ones if necessary
+  def put(self,key,entry):
+    with self.lock:
+      self.entries[key] = entry
+      self.entries.move_to_end(key)
+      self.evict()
+
+  # returns the entry for key, calling solve() to make it if there is none
+  # If several threads ask for the same missing key at once, only one of them
+  # calls solve and the others wait for its result.
+  def getOrSolve(self,key,solve):
+    with self.lock:
+      entry = self.get(key)
+      if entry is not None:
+        return entry
+      pending = self.pending.get(key)
+      solving = pending is None
+      if solving:
+        pending = PendingSolve()
+        self.pending[key] = pending
+    if not solving:
+      pending.done.wait()
+      if pending.entry is None:
+        #the solving thread failed; try again
+        return self.getOrSolve(key,solve)
+      return pending.entry
+    try:
+      pending.entry = solve()
+      self.put(key,pending.entry)
+    finally:
+      with self.lock:
+        del self.pending[key]
+      pending.done.set()
+    return pending.entry
+
+  # changes the maximum number of tables kept
+  def resize(self,size):
+    with self.lock:
+      self.size = size
+      self.evict()
+
+  # removes least recently used entries until there are at most size left
+  def evict(self):
+    with self.lock:
+      while len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+
+  # returns a list of the (extrasWin, table) entries in the cache
+  def tables(self):
+    with self.lock:
+      return list(self.entries.values())
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+  # removes the tables solved with an older generation of a coefficient set
+  def invalidate(self,coefficients):
+    with self.lock:
+      for key in list(self.entries):
+        if key[2] == coefficients.name and key[3] != coefficients.generation:
+          del self.entries[key]
+
+# a table solve in progress in TableCache.getOrSolve; entry is set (to the
+# solved entry) before done is, unless the solve failed
+class PendingSolve:
+  def __init__(self):
+    self.done = threading.Event()
+    self.entry = None
+
+# default cache used by WinExpCalculator
+tableCache = TableCache()
+
+# Counters for the work WinExpCalculator does, so a service can export them
+# as metrics and tell cache misses from solving and coefficient loading time.
+# Collection is off unless enableStats is called; while it is off, the only
+# cost is one check for None per call.  Counters are not locked, so with many
+# threads they are approximate.
+class WinExpStats:
+  def __init__(self):
+    self.reset()
+
+  # sets every counter back to zero
+  def reset(self):
+    #getWinPct/getWinPctByCode calls, and how many had to solve first
+    self.lookups = 0
+    self.lookupMisses = 0
+    #TableCache hits and misses when calculators are constructed
+    self.cacheHits = 0
+    self.cacheMisses = 0
+    #table solves, the half innings they worked through and their time
+    self.solves = 0
+    self.halfInnings = 0
+    self.solveSeconds = 0.0
+    self.maxSolveSeconds = 0.0
+    #getExptRuns calls, and how many were not memoized yet
+    self.exptRunsCalls = 0
+    self.exptRunsMisses = 0
+    #coefficient files read and time spent reading them
+    self.coeffLoads = 0
+    self.coeffLoadSeconds = 0.0
+
+  # returns the counters as a dict, along with the memory held by the solved
+  # tables in the default tableCache
+  def snapshot(self):
+    snap = dict(self.__dict__)
+    tables = tableCache.tables()
+    snap["cacheTables"] = len(tables)
+    snap["cacheTableBytes"] = sum(tableBytes(table)
+        for extrasWin, table in tables)
+    return snap
+
+# the active WinExpStats, or None while collection is off
+stats = None
+
+# turns on collection of WinExpStats counters
+def enableStats():
+  global stats
+  if stats is None:
+    stats = WinExpStats()
+
+# turns off collection and drops the counters
+def disableStats():
+  global stats
+  stats = None
+
+# returns a snapshot dict of the counters, or None if collection is off
+def getStats():
+  if stats is None:
+    return None
+  return stats.snapshot()
+
+# resets the counters, if collection is on
+def resetStats():
+  if stats is not None:
+    stats.reset()
+
+# A named set of run distribution coefficients (for example, for one era or
+# league), read from its .csv file the first time it is needed and shared by
+# every calculator constructed with its name.  The file's contents are
+# identified by a digest, so reload can tell whether the file really changed.
+# generation goes up every time it does; tables are cached per generation.
+class CoefficientSet:
+
+  # name: name calculators ask for the set by
+  # path: coefficient .csv file (see loadCoefficients)
+  def __init__(self,name,path):
+    self.name = name
+    self.path = path
+    self.generation = 0
+    #(digest, rows) once the file has been read
+    self.data = None
+    self.lock = threading.Lock()
+    #calculators using the set, reset when it is reloaded
+    self.calcs = weakref.WeakSet()
+    #(data, coefficient matrix) made by getMatrix
+    self.matrix = None
+
+  # returns the coefficient rows, reading the file on first use
+  def getRows(self):
+    return self.getData()[1]
+
+  # returns the digest of the file's contents, reading it on first use
+  def getDigest(self):
+    return self.getData()[0]
+
+  # returns the coefficients as a 24 x 12 numpy array, with the row for
+  # (baseSt-1)*3 + outs holding slope, intercept, r1, ..., r10 (NaN for the
+  # empty/no out state).  It is built once per reload.
+  def getMatrix(self):
+    #numpy is only needed for the vectorized kernels, so it is imported here
+    import numpy as np
+    data = self.getData()
+    matrix = self.matrix
+    if matrix is None or matrix[0] is not data:
+      matrix = self.matrix = (data, np.array([[math.nan]*12 if row is None
+          else row[1:] for row in data[1]]))
+    return matrix[1]
+
+  def getData(self):
+    data = self.data
+    if data is None:
+      with self.lock:
+        if self.data is None:
+          self.data = loadCoefficients(self.path)
+        data = self.data
+    return data
+
+  def addCalc(self,calc):
+    with self.lock:
+      self.calcs.add(calc)
+
+  # reads the file again; returns True if its contents changed
+  # When they did, the new rows are used in place: every calculator using
+  # the set starts over with them, and the tables solved with the old rows
+  # are dropped from the caches those calculators share.  Tables solved with
+  # other coefficient sets are kept.  Threads in the middle of a solve or a
+  # lookup finish it with the old rows.
+  def reload(self):
+    data = loadCoefficients(self.path)
+    with self.lock:
+      if self.data is None or self.data[0] == data[0]:
+        self.data = data
+        return False
+      self.data = data
+      self.generation += 1
+      calcs = list(self.calcs)
+    caches = {id(tableCache): tableCache}
+    for calc in calcs:
+      calc.resetCoefficients()
+      if calc.cache is not None:
+        caches[id(calc.cache)] = calc.cache
+    for cache in caches.values():
+      cache.invalidate(self)
+    return True
+
+# registered coefficient sets, by name
+coefficientSets = {
+    DEFAULT_COEFFICIENTS: CoefficientSet(DEFAULT_COEFFICIENTS,COEFF_FILE)}
+
+coefficientSetsLock = threading.Lock()
+
+# registers a coefficient set under name and returns it.  The file is not
+# read until the set is first used.  Registering a new file under a name
+# that is already in use switches the set to it and reloads it.
+def addCoefficients(name,path):
+  with coefficientSetsLock:
+    coeffSet = coefficientSets.get(name)
+    if coeffSet is None:
+      coeffSet = coefficientSets[name] = CoefficientSet(name,path)
+      return coeffSet
+    if coeffSet.path == path:
+      return coeffSet
+    coeffSet.path = path
+  coeffSet.reload()
+  return coeffSet
+
+# returns the CoefficientSet registered under name
+# Raises ValueError if there is none.
+def getCoefficientSet(name=DEFAULT_COEFFICIENTS):
+  try:
+    return coefficientSets[name]
+  except KeyError:
+    raise ValueError("no coefficient set named " + repr(name)) from None
+
+# returns the rows of a coefficient set, reading them on first use
+def getCoefficients(name=DEFAULT_COEFFICIENTS):
+  return getCoefficientSet(name).getRows()
+
+# reads the files of a coefficient set (or of every set, if name is None)
+# again; returns the names of the sets whose contents changed.  See
+# CoefficientSet.reload.
+def reloadCoefficients(name=None):
+  if name is None:
+    with coefficientSetsLock:
+      coeffSets = list(coefficientSets.values())
+  else:
+    coeffSets = [getCoefficientSet(name)]
+  return [coeffSet.name for coeffSet in coeffSets if coeffSet.reload()]
+
+# reads a coefficient .csv file; returns (digest, rows), where digest
+# identifies the file's contents and rows is a list of rows indexed by
+# (baseSt-1)*3 + outs; the empty/no out state has no row.  Each row is the
+# tuple (baseOuts, slope, intercept, r1, ..., r10).
+def loadCoefficients(path):
+  start = time.perf_counter()
+  with open(path, "rb") as f:
+    data = f.read()
+  coeffs = [None]*24
+  for line in data.decode().splitlines()[1:]:
+    if not line.strip():
+      continue
+    vals = line.split(",")
+    baseOuts = vals[0].strip()
+    coeffs[(int(baseOuts[0])-1)*3 + int(baseOuts[1])] = \
+        (baseOuts,) + tuple(float(val) for val in vals[1:])
+  if stats is not None:
+    stats.coeffLoads += 1
+    stats.coeffLoadSeconds += time.perf_counter() - start
+  return hashlib.blake2b(data, digest_size=16).digest(), coeffs
+
+# returns the number of bytes of table data in a solved table
+def tableBytes(table):
+  return memoryview(table).nbytes
 
 # This class is used to calculate the win expectancy at any point in the game
 # It requires a number of pre-calculated coefficients, which are read from a 
-# .csv file and stored in a sql database
+# .csv file
+# Constructing a calculator does no I/O and no solving: the coefficients are
+# read, and extrasWin and the table computed, the first time they are needed.
+# A calculator can be shared by many threads.  Lookups read the solved table
+# without locking (it never changes once set), and the table is only solved
+# once, by one thread, however many ask for it at the same time.
 class WinExpCalculator:
 
   # Initializer function
@@ -15,38 +384,60 @@ class WinExpCalculator:
   #     can be used to model a home team advantage, or to model a difference
   #     in talent level between the two teams.  Calculations will be slightly
   #     less accurate if values very different from .5 are used
-  def __init__(self,runEnv,homeWin):
-    self.setupDatabase()
+  # eager: if True, the whole state space is solved up front so that every
+  #     later call to getWinPct is a constant time table lookup
+  # cache: TableCache to share solved tables through (the module's tableCache
+  #     by default); None solves a private table
+  # coefficients: name of the coefficient set to use (see addCoefficients)
+  def __init__(self,runEnv,homeWin,eager=False,cache=tableCache,
+      coefficients=DEFAULT_COEFFICIENTS):
+    self.runDists = {}
     self.runEnv = runEnv
     self.homeWin = homeWin
     self.homeRpi = (2*runEnv/(1 + math.pow(1/self.homeWin - 1,1/1.8)))/9
     self.visRpi = (2*runEnv/(1 + math.pow(1/(1-self.homeWin) - 1,1/1.8)))/9
-    self.extrasWin = self.getExtrasWin()
-    self.calcedDict = {}
+    self.cache = cache
+    self.coeffSet = getCoefficientSet(coefficients)
+    self.coeffSet.addCalc(self)
+    self.solveLock = threading.Lock()
+    self.table = None
+    entry = None
+    if cache is not None:
+      self.cacheKey = cache.key(runEnv,homeWin,self.coeffSet)
+      entry = cache.get(self.cacheKey)
+    if stats is not None and cache is not None:
+      if entry is None:
+        stats.cacheMisses += 1
+      else:
+        stats.cacheHits += 1
+    self.extrasWinValue = None
+    if entry is not None:
+      self.extrasWinValue, self.table = entry
+    if eager and self.table is None:
+      self.buildTable()
   
-  def setupDatabase(self):
-    coeffFile = "baseruns_coefficients.csv"
-    self.conn = sql.connect('baseruns_coefficients_db.db')
-    self.c = self.conn.cursor()
-    try:
-      self.c.execute("""create table run_coefficients 
-      (baseouts text,slope float, intercept float, 
-      r1 float, r2 float, r3 float, r4 float, r5 float, 
-      r6 float, r7 float, r8 float, r9 float, r10 float)""")
-    except sql.OperationalError as sqlErr:
-      print("sql message: " + str(sqlErr))
-      print("Database probably already exists, continuing...")
-      return
-    skip = 1
-    for line in open(coeffFile):
-      if skip == 1:
-        skip = 0
-        continue
-      vals = line.split(",")
-      self.c.execute(
-          "insert into run_coefficients values (?,?,?,?,?,?,?,?,?,?,?,?,?)",
-          vals)
-    self.conn.commit()
+  # name of the coefficient set the calculator uses
+  @property
+  def coefficients(self):
+    return self.coeffSet.name
+
+  # drops everything solved with the coefficient set's old rows, so that the
+  # next lookup starts over with the new ones; called when the set is
+  # reloaded.  extrasWin does not depend on the coefficients and is kept.
+  def resetCoefficients(self):
+    with self.solveLock:
+      self.runDists = {}
+      self.table = None
+      if self.cache is not None:
+        self.cacheKey = self.cache.key(self.runEnv,self.homeWin,self.coeffSet)
+
+  # the win% of the home team in extra innings (see getExtrasWin), computed
+  # the first time it is needed
+  @property
+  def extrasWin(self):
+    if self.extrasWinValue is None:
+      self.extrasWinValue = self.getExtrasWin()
+    return self.extrasWinValue
  
   # returns an array containing the odds that each number of runs will
   # be scored in a given inning
@@ -82,27 +473,290 @@ class WinExpCalculator:
   # returns an array containing the odds that each number of runs
   # will be scored in the remainder of the inning, given a number of outs
   # and runner configuration
+  # Results are memoized per (baseSt, outs, rpi), since solving the table
+  # asks for the same few distributions over and over
   # Variables:
   #     baseSt: integer 1-8 representing different baserunner configurations
   #     outs: number of outs in the inning
   #     rpi: average runs per inning
   def getExptRuns(self,baseSt,outs,rpi):
-    baseOuts = str(baseSt) + str(outs);
-    if baseOuts == '10':
-      return self.getRunPct(rpi);
-    for row in self.c.execute("select * from run_coefficients where baseouts=?",
-        (baseOuts,)):
-      coeffs = row
-    adjPcnts = []
-    adjPcnts.append(rpi*coeffs[1] + coeffs[2])
-    for run in range(1,11):
-      adjPcnts.append((1-adjPcnts[0])*coeffs[run+2])
+    key = (baseSt,outs,rpi)
+    if stats is not None:
+      stats.exptRunsCalls += 1
+    try:
+      return self.runDists[key]
+    except KeyError:
+      pass
+    if stats is not None:
+      stats.exptRunsMisses += 1
+    if baseSt == 1 and outs == 0:
+      adjPcnts = self.getRunPct(rpi)
+    else:
+      coeffs = self.coeffSet.getRows()[(baseSt-1)*3 + outs]
+      adjPcnts = []
+      adjPcnts.append(rpi*coeffs[1] + coeffs[2])
+      for run in range(1,11):
+        adjPcnts.append((1-adjPcnts[0])*coeffs[run+2])
+    adjPcnts = tuple(adjPcnts)
+    self.runDists[key] = adjPcnts
     return adjPcnts
 
+  # The three kernels below are vectorized versions of getRunPct,
+  # getExptRuns and getExtrasWin for sweeping many rpi values at once.  They
+  # take numpy arrays (or anything numpy.asarray accepts) of any shape and
+  # do the same floating point operations in the same order as the scalar
+  # versions, so the results are identical.  They need numpy.
+
+  # getRunPct for an array of rpi; returns an array of shape rpi.shape + (11,)
+  def getRunPctBatch(self,rpi):
+    import numpy as np
+    rpi = np.asarray(rpi, dtype=np.float64)
+    pcnts = np.empty(rpi.shape + (11,))
+    for i in range(0,11):
+      #float_power calls the C library's pow, like math.pow; np.power does
+      #not always round the same way
+      bot = np.float_power(rpi*.761 + 1,i+1)
+      if i==0:
+        top = 1
+      else:
+        top = rpi*.761*.761*np.float_power(rpi*.761 - .761 + 1,i-1)
+      pcnts[...,i] = top/bot
+    return pcnts
+
+  # getExptRuns for every base/out state and an array of rpi; returns an
+  # array of shape rpi.shape + (24, 11), where [..., (baseSt-1)*3 + outs, :]
+  # is the distribution getExptRuns(baseSt, outs, rpi) returns
+  def getExptRunsBatch(self,rpi):
+    import numpy as np
+    rpi = np.asarray(rpi, dtype=np.float64)
+    coeffs = self.coeffSet.getMatrix()
+    dists = np.empty(rpi.shape + (24, 11))
+    zeroRuns = rpi[...,np.newaxis]*coeffs[:,0] + coeffs[:,1]
+    dists[...,0] = zeroRuns
+    dists[...,1:] = (1-zeroRuns)[...,np.newaxis]*coeffs[:,2:]
+    #no one on and no outs is the start of an inning
+    dists[...,0,:] = self.getRunPctBatch(rpi)
+    return dists
+
+  # getExtrasWin for arrays of home and visitor rpi (broadcast together);
+  # returns an array of the home team's win% in extra innings
+  def getExtrasWinBatch(self,homeRpi,visRpi):
+    import numpy as np
+    homeScorePct = self.getRunPctBatch(homeRpi)
+    visitScorePct = self.getRunPctBatch(visRpi)
+    shape = np.broadcast_shapes(homeScorePct.shape[:-1],
+        visitScorePct.shape[:-1])
+    homeWinPct = np.zeros(shape)
+    visWinPct = np.zeros(shape)
+    #the sums run in the same order as getExtrasWin's loops
+    for hRuns in range(1,11):
+      for vRuns in range(0,hRuns):
+        homeWinPct += homeScorePct[...,hRuns]*visitScorePct[...,vRuns]
+    for vRuns in range(1,11):
+      for hRuns in range(0,vRuns):
+        visWinPct += homeScorePct[...,hRuns]*visitScorePct[...,vRuns]
+    return homeWinPct/(visWinPct+homeWinPct)
+
+  # writes the solved table (solving it first if needed) to a binary file
+  # that loadTable or openTable can map back in.  The file is written to a
+  # temporary name and renamed, so readers never see a partial table.
+  def saveTable(self,path):
+    if self.table is None:
+      self.buildTable()
+    writeTableFile(path,self.table,self.runEnv,self.homeWin,self.extrasWin,
+        self.coeffSet.getDigest())
+
+  # returns the solved table (solving it first if needed) rounded to 16 bit
+  # fixed point, as a QuantizedTable
+  # Raises ValueError if a win% is outside the range that can be stored.
+  def quantize(self):
+    if self.table is None:
+      self.buildTable()
+    try:
+      table = array('H', [int(winPct*QUANT_SCALE + QUANT_ZERO + .5)
+          for winPct in self.table])
+    except OverflowError:
+      raise ValueError("win expectancy out of range for a quantized table " +
+          "(runEnv " + str(self.runEnv) + ", homeWin " + str(self.homeWin) +
+          ")") from None
+    return QuantizedTable(table,self.runEnv,self.homeWin,self.extrasWin,
+        self.coeffSet.getDigest())
+
+  # memory maps a table written by saveTable and uses it for every lookup
+  # The table is read-only and shared with any other process mapping the
+  # same file.  Raises ValueError if the file is not a table for this
+  # calculator's runEnv, homeWin and coefficients.
+  def loadTable(self,path):
+    table, runEnv, homeWin, extrasWin, digest = mapTableFile(path)
+    if runEnv != self.runEnv or homeWin != self.homeWin:
+      raise ValueError("table file " + path + " was solved for runEnv " +
+          str(runEnv) + ", homeWin " + str(homeWin))
+    self.checkDigest(path,digest)
+    self.setTable(table,extrasWin)
+
+  # raises ValueError if a table file was not solved with the current
+  # contents of this calculator's coefficient set
+  def checkDigest(self,path,digest):
+    if digest != self.coeffSet.getDigest():
+      raise ValueError("table file " + path + " was not solved with the " +
+          "current coefficient set " + repr(self.coefficients))
+
+  # uses an already solved table (and the extrasWin it was solved with) for
+  # every lookup, sharing it through the cache
+  def setTable(self,table,extrasWin):
+    self.extrasWinValue = extrasWin
+    self.table = table
+    if self.cache is not None:
+      self.cache.put(self.cacheKey,(extrasWin,table))
+
+  # solves the table, unless it is already solved (or in the cache), and uses
+  # it for every lookup from now on
+  def buildTable(self):
+    with self.solveLock:
+      if self.table is not None:
+        return
+      if self.cache is None:
+        self.table = self.solveTable()
+      else:
+        entry = self.cache.getOrSolve(self.cacheKey,
+            lambda: (self.extrasWin, self.solveTable()))
+        self.extrasWinValue, self.table = entry
+
+  # solves every state in the model and returns the results in a dense
+  # array, indexed by state code.
+  # The table is filled bottom-up, one half inning at a time, starting from
+  # the bottom of the 9th (the base case) and working back to the top of the
+  # 1st.  Each half inning only depends on the win% at the start of the
+  # following half inning, so no recursion is needed.
+  def solveTable(self):
+    start = time.perf_counter()
+    table = array('d', bytes(8*NUM_CODES))
+    table[HOME_WIN_CODE] = 1.0
+    table[VISITOR_WIN_CODE] = 0.0
+    nextStart = None
+    for inning in range(9,0,-1):
+      for half in (1,0):
+        self.solveHalfInning(table,inning,half,nextStart)
+        # win% at the start of this half inning (bases empty, no outs), padded
+        # with 10 decided games on either side so that any number of runs can
+        # be scored without going off the end
+        nextStart = [0.0]*10
+        for scoreDiff in range(-MAX_DIFF,MAX_DIFF+1):
+          nextStart.append(table[encodeState(1,scoreDiff,inning,0,half)])
+        nextStart += [1.0]*10
+    if stats is not None:
+      elapsed = time.perf_counter() - start
+      stats.solves += 1
+      stats.halfInnings += 18
+      stats.solveSeconds += elapsed
+      stats.maxSolveSeconds = max(stats.maxSolveSeconds, elapsed)
+    return table
+
+  # fills in the table for every base state, out and score of one half inning
+  # Variables:
+  #  table: the array being built by solveTable
+  #  inning, half: the half inning to solve
+  #  nextStart: padded win% at the start of the following half inning, as
+  #      built by solveTable; unused for the bottom of the 9th
+  def solveHalfInning(self,table,inning,half,nextStart):
+    mod = 1 #so that runs are added/subtracted to scoreDiff correctly
+    if half == 0:
+      rpi = self.visRpi
+      mod = -1
+    else:
+      rpi = self.homeRpi
+    for outs in range(0,3):
+      for baseState in range(1,9):
+        runPcts = self.getExptRuns(baseState,outs,rpi)
+        code = encodeState(baseState,-MAX_DIFF,inning,outs,half)
+        for scoreDiff in range(-MAX_DIFF,MAX_DIFF+1):
+          if inning == 9 and half == 1:
+            prob = self.getBottomNinthPct(scoreDiff,runPcts)
+          else:
+            # for each possible number of runs scored in the rest of the
+            # inning, add the odds of that many runs times the win% at the
+            # start of the next half inning:
+            prob = 0
+            start = scoreDiff + MAX_DIFF + 10
+            for run in range(0,11):
+              prob += runPcts[run] * nextStart[start + mod*run]
+          table[code + scoreDiff + MAX_DIFF] = prob
+
+  # win% of the home team in the bottom of the 9th (or any later inning)
+  # scoreDiff: number of runs that the home team leads by
+  # runPcts: odds of the home team scoring each number of runs in the
+  #     remainder of the inning
+  def getBottomNinthPct(self,scoreDiff,runPcts):
+    if scoreDiff > 0: #home team has won
+      return 1
+    if scoreDiff == 0: 
+      #odds home doesn't score 0, plus their win% in extras
+      return (1-runPcts[0]) + self.extrasWin*runPcts[0]
+    #home is behind
+    prob = 0
+    for run in range(1,11):
+      if scoreDiff + run > 0: #home wins
+        prob += runPcts[run]
+      if scoreDiff + run == 0: #home ties
+        prob += runPcts[run]*self.extrasWin
+    return prob
+
+  # getWinPctBatch
+  # Vectorized version of getWinPct for scoring many game states at once.
+  # Requires numpy.  Solves the full table on first use (if it has not been
+  # built already), then computes every answer with a single gather from it.
+  # Variables:
+  #  baseState: array of base states 1-8, or a numpy structured array with
+  #      fields baseState, scoreDiff, inning, outs and half (in which case
+  #      the other arguments are left out)
+  #  scoreDiff, inning, outs, half: arrays (or scalars) that broadcast
+  #      with baseState, with the same meaning as in getWinPct
+  # Returns a float array of the home team's win probabilities, of the
+  # arguments' broadcast shape
+  def getWinPctBatch(self,baseState,scoreDiff=None,inning=None,outs=None,
+      half=None):
+    #numpy is only needed here, so it is not imported until first use
+    import numpy as np
+    if scoreDiff is None:
+      states = baseState
+      baseState = states['baseState']
+      scoreDiff = states['scoreDiff']
+      inning = states['inning']
+      outs = states['outs']
+      half = states['half']
+    baseState = np.asarray(baseState, dtype=np.int64)
+    scoreDiff = np.asarray(scoreDiff, dtype=np.int64)
+    inning = np.asarray(inning, dtype=np.int64)
+    outs = np.asarray(outs, dtype=np.int64)
+    half = np.asarray(half, dtype=np.int64)
+    if (np.any((baseState < 1) | (baseState > 8)) or
+        np.any((outs < 0) | (outs > 2)) or
+        np.any((half < 0) | (half > 1)) or np.any(inning < 1)):
+      raise ValueError("getWinPctBatch: game state out of range")
+    if stats is not None:
+      stats.lookups += np.broadcast(baseState,scoreDiff,inning,outs,
+          half).size
+      if self.table is None:
+        stats.lookupMisses += 1
+    if self.table is None:
+      self.buildTable()
+    table = np.frombuffer(self.table, dtype=np.float64)
+    #innings 9 and later are treated the same in this model
+    inning = np.minimum(inning, 9)
+    diff = np.clip(scoreDiff, -MAX_DIFF, MAX_DIFF)
+    codes = ((((inning-1)*2 + half)*3 + outs)*8 + baseState-1)*NUM_DIFFS \
+        + diff + MAX_DIFF
+    #game is very close to decided:
+    codes = np.where(scoreDiff > MAX_DIFF, HOME_WIN_CODE, codes)
+    codes = np.where(scoreDiff < -MAX_DIFF, VISITOR_WIN_CODE, codes)
+    probs = table[codes]
+    return probs
+
   # getWinPct
-  # This function recursively calculates the odds that the home team will win.
+  # This function calculates the odds that the home team will win.
   # It calculates these odds based on the inning, the runners on base, the
-  # number of outs, and the score
+  # number of outs, and the score.  The first call solves the whole table
+  # (see buildTable); every call after that is a lookup.
   # Variables:
   #  baseState: integers 1-8 designate different base runner configurations
   #  scoreDiff: number of runs that the home team leads by (can be negative)
@@ -110,52 +764,122 @@ class WinExpCalculator:
   #  outs: number of outs; 0-2
   #  half: 0 signifies top of inning, 1 signifies bottom
   def getWinPct(self,baseState,scoreDiff,inning,outs,half):
-    
-    #innings 9 and later are treated the same in this model
-    if inning > 9:
-      inning=9
-    #game is very close to decided:
-    if scoreDiff > 15:
-      return 1
-    if scoreDiff < -15:
+    return self.getWinPctByCode(
+        encodeState(baseState,scoreDiff,inning,outs,half))
+
+  # same as getWinPct, for a state already packed with StateCode.encodeState
+  # (or GameState.getStateCode)
+  def getWinPctByCode(self,code):
+    table = self.table
+    if stats is not None:
+      stats.lookups += 1
+      if table is None:
+        stats.lookupMisses += 1
+    if table is None:
+      self.buildTable()
+      table = self.table
+    return table[code]
+
+  # returns the number of bytes of table data this calculator holds (0 if
+  # it has not been solved yet)
+  def tableBytes(self):
+    if self.table is None:
       return 0
+    return tableBytes(self.table)
 
-    #see if this particular state has already been calculated;
-    #this prevents many unnecessary recursive calls
-    key = str(baseState) + str(scoreDiff) + str(inning) + str(outs) + str(half)
-    try:
-      prob = self.calcedDict[key]
-    except KeyError:
-      prob = 0
-    else:
-      return prob
-   
-    mod = 1 #so that runs are added/subtracted to scoreDiff correctly
-    if half == 0:
-      runPcts = self.getExptRuns(baseState,outs,self.visRpi)
-      mod = -1
-    elif half == 1:
-      runPcts = self.getExptRuns(baseState,outs,self.homeRpi)
-      #bottom 9
-      if inning==9:
-        if scoreDiff > 0: #home team has won
-          return 1
-        if scoreDiff == 0: 
-          #odds home doesn't score 0, plus their win% in extras
-          return (1-runPcts[0]) + self.extrasWin*runPcts[0]
-        if scoreDiff < 0: #home is behind
-          prob = 0
-          for run in range(1,11):
-            if scoreDiff + run > 0: #home wins
-              prob += runPcts[run]
-            if scoreDiff + run == 0: #home ties
-              prob += runPcts[run]*self.extrasWin
-          return prob
-    prob = 0
-    # for each possible number of runs scored in the rest of the inning, 
-    # recursively calculate the win% based on that new game state:
-    for run in range(0,11):
-      prob += runPcts[run] * self.getWinPct(1, scoreDiff + mod*run, 
-          inning + half, 0, (half+1)%2)
-      self.calcedDict[key] = prob
-    return prob
+# A solved table stored as 16 bit fixed point numbers (see QUANT_SCALE), for
+# keeping thousands of tables resident at once: it takes about 27KB, against
+# about 107KB for a full table.  It answers lookups like a solved
+# WinExpCalculator, to within QUANT_ERROR, straight from the stored integers.
+# Made with WinExpCalculator.quantize or openQuantizedTable.
+class QuantizedTable:
+  __slots__ = ('table', 'runEnv', 'homeWin', 'extrasWin', 'digest')
+
+  # table: array or memoryview of unsigned shorts, indexed by state code
+  # runEnv, homeWin, extrasWin: parameters the table was solved with
+  # digest: digest of the coefficients the table was solved with
+  def __init__(self,table,runEnv,homeWin,extrasWin,digest):
+    self.table = table
+    self.runEnv = runEnv
+    self.homeWin = homeWin
+    self.extrasWin = extrasWin
+    self.digest = digest
+
+  # same as WinExpCalculator.getWinPct
+  def getWinPct(self,baseState,scoreDiff,inning,outs,half):
+    return self.getWinPctByCode(
+        encodeState(baseState,scoreDiff,inning,outs,half))
+
+  # same as WinExpCalculator.getWinPctByCode
+  def getWinPctByCode(self,code):
+    return (self.table[code] - QUANT_ZERO)/QUANT_SCALE
+
+  # writes the table to a file that openQuantizedTable can map back in
+  def save(self,path):
+    writeTableFile(path,self.table,self.runEnv,self.homeWin,self.extrasWin,
+        self.digest)
+
+  # returns the number of bytes of table data
+  def tableBytes(self):
+    return tableBytes(self.table)
+
+# writes a table file (see TABLE_HEADER) for an array or memoryview of
+# doubles or unsigned shorts.  The file is written to a temporary name and
+# renamed, so readers never see a partial table.
+def writeTableFile(path,table,runEnv,homeWin,extrasWin,digest):
+  header = TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, TABLE_BYTE_ORDER,
+      MAX_DIFF, NUM_CODES, runEnv, homeWin, extrasWin, digest,
+      memoryview(table).format.encode())
+  tmpPath = path + ".tmp"
+  with open(tmpPath, "wb") as f:
+    f.write(header)
+    f.write(memoryview(table).cast('B'))
+  os.replace(tmpPath, path)
+
+# memory maps a table file written by WinExpCalculator.saveTable
+# returns (table, runEnv, homeWin, extrasWin, digest), where table is a
+# read-only memoryview of doubles backed by the file and digest identifies
+# the coefficients it was solved with
+def mapTableFile(path):
+  return mapTypedTableFile(path,'d')
+
+# same as mapTableFile, for a table file of the given array typecode
+# ('d' for full tables, 'H' for quantized ones)
+def mapTypedTableFile(path,typecode):
+  with open(path, "rb") as f:
+    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  if len(mapped) < TABLE_HEADER.size:
+    raise ValueError(path + " is not a win expectancy table")
+  (magic, version, byteOrder, maxDiff, count, runEnv, homeWin,
+      extrasWin, digest, fileTypecode) = TABLE_HEADER.unpack_from(mapped)
+  if magic != TABLE_MAGIC:
+    raise ValueError(path + " is not a win expectancy table")
+  if version != TABLE_VERSION:
+    raise ValueError(path + ": unsupported table version " + str(version))
+  if byteOrder != TABLE_BYTE_ORDER:
+    raise ValueError(path + " was written on a machine of different byte order")
+  if maxDiff != MAX_DIFF or count != NUM_CODES:
+    raise ValueError(path + " was written with a different table size")
+  if fileTypecode != typecode.encode():
+    if fileTypecode == b'H':
+      raise ValueError(path + " is a quantized table; see openQuantizedTable")
+    raise ValueError(path + " is not a quantized table; see openTable")
+  if len(mapped) != TABLE_HEADER.size + struct.calcsize(typecode)*count:
+    raise ValueError(path + " is truncated")
+  table = memoryview(mapped)[TABLE_HEADER.size:].cast(typecode)
+  return table, runEnv, homeWin, extrasWin, digest
+
+# returns a WinExpCalculator backed by a memory mapped table file, using the
+# runEnv and homeWin the file was solved for
+# Raises ValueError if the file was not solved with the named coefficient set.
+def openTable(path,cache=tableCache,coefficients=DEFAULT_COEFFICIENTS):
+  table, runEnv, homeWin, extrasWin, digest = mapTableFile(path)
+  calc = WinExpCalculator(runEnv,homeWin,cache=cache,coefficients=coefficients)
+  calc.checkDigest(path,digest)
+  calc.setTable(table,extrasWin)
+  return calc
+
+# returns a QuantizedTable backed by a memory mapped file written by
+# QuantizedTable.save
+def openQuantizedTable(path):
+  return QuantizedTable(*mapTypedTableFile(path,'H'))
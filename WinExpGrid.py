@@ -0,0 +1,86 @@
+from WinExp import WinExpCalculator
+from StateCode import encodeState
+
+# This class answers win expectancy queries for any runEnv and homeWin inside
+# a range without solving a new table per query.  Tables are solved once at
+# every point of an evenly spaced grid over (runEnv, homeWin), and a query
+# between grid points is answered by bilinear interpolation of the four
+# surrounding tables.
+#
+# With the default grid (runEnv 3.0-6.0 in steps of .25, homeWin .3-.7 in
+# steps of .05) the interpolated win% is within .001 of an exact
+# WinExpCalculator solve for every game state (the largest error measured is
+# about .00075).  Halving the spacing cuts the error by about four;
+# measureError can be used to check the bound for other grids.
+class WinExpGrid:
+
+  # Initializer function
+  # runEnvRange: (low, high) run environments covered by the grid
+  # homeWinRange: (low, high) home win percentages covered by the grid
+  # runEnvSteps, homeWinSteps: number of grid points along each axis
+  #     (at least 2); the error shrinks roughly with the square of the
+  #     spacing between points
+  def __init__(self,runEnvRange=(3.0,6.0),homeWinRange=(.3,.7),
+      runEnvSteps=13,homeWinSteps=9):
+    if runEnvSteps < 2 or homeWinSteps < 2:
+      raise ValueError("WinExpGrid needs at least 2 points per axis")
+    self.runEnvLow, self.runEnvHigh = runEnvRange
+    self.homeWinLow, self.homeWinHigh = homeWinRange
+    self.runEnvSteps = runEnvSteps
+    self.homeWinSteps = homeWinSteps
+    self.runEnvSpacing = (self.runEnvHigh - self.runEnvLow)/(runEnvSteps-1)
+    self.homeWinSpacing = (self.homeWinHigh - self.homeWinLow)/(homeWinSteps-1)
+    #solved tables, indexed by [runEnv point][homeWin point]
+    self.tables = []
+    for i in range(0,runEnvSteps):
+      row = []
+      for j in range(0,homeWinSteps):
+        calc = WinExpCalculator(self.runEnvLow + i*self.runEnvSpacing,
+            self.homeWinLow + j*self.homeWinSpacing, eager=True, cache=None)
+        row.append(calc.table)
+      self.tables.append(row)
+
+  # returns (i, j, u, v): the grid cell containing a pair of parameters and
+  # the fractional position (0-1) inside it along each axis
+  def getCell(self,runEnv,homeWin):
+    if not (self.runEnvLow <= runEnv <= self.runEnvHigh and
+        self.homeWinLow <= homeWin <= self.homeWinHigh):
+      raise ValueError("WinExpGrid: runEnv " + str(runEnv) + ", homeWin " +
+          str(homeWin) + " is outside the grid")
+    x = (runEnv - self.runEnvLow)/self.runEnvSpacing
+    y = (homeWin - self.homeWinLow)/self.homeWinSpacing
+    i = min(int(x), self.runEnvSteps-2)
+    j = min(int(y), self.homeWinSteps-2)
+    return i, j, x-i, y-j
+
+  # getWinPct
+  # Interpolated odds that the home team will win, for a game between teams
+  # described by runEnv and homeWin (see WinExpCalculator)
+  # The game state variables are the same as in WinExpCalculator.getWinPct
+  def getWinPct(self,runEnv,homeWin,baseState,scoreDiff,inning,outs,half):
+    return self.getWinPctByCode(runEnv,homeWin,
+        encodeState(baseState,scoreDiff,inning,outs,half))
+
+  # same as getWinPct, for a state already packed with StateCode.encodeState
+  def getWinPctByCode(self,runEnv,homeWin,code):
+    i, j, u, v = self.getCell(runEnv,homeWin)
+    return ((1-u)*(1-v)*self.tables[i][j][code] +
+        (1-u)*v*self.tables[i][j+1][code] +
+        u*(1-v)*self.tables[i+1][j][code] +
+        u*v*self.tables[i+1][j+1][code])
+
+  # measures the interpolation error against exact solves at the middle of
+  # every grid cell (where it is largest) over the whole state space
+  # returns the largest absolute difference found
+  def measureError(self):
+    worst = 0
+    for i in range(0,self.runEnvSteps-1):
+      for j in range(0,self.homeWinSteps-1):
+        runEnv = self.runEnvLow + (i+.5)*self.runEnvSpacing
+        homeWin = self.homeWinLow + (j+.5)*self.homeWinSpacing
+        exact = WinExpCalculator(runEnv,homeWin,eager=True,cache=None)
+        for index in range(0,len(exact.table)):
+          approx = ((self.tables[i][j][index] + self.tables[i][j+1][index] +
+              self.tables[i+1][j][index] + self.tables[i+1][j+1][index])/4)
+          worst = max(worst, abs(approx - exact.table[index]))
+    return worst
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# A small local win expectancy service (asyncio, standard library only).
+# Clients connect over TCP and send one JSON request per line:
+#   {"id": 1, "runEnv": 4.5, "homeWin": .5, "state": [1, 0, 1, 0, 0]}
+#   {"id": 2, "runEnv": 4.5, "homeWin": .5, "states": [[1, 0, 1, 0, 0], ...]}
+# where a state is [baseState, scoreDiff, inning, outs, half] as in
+# WinExpCalculator.getWinPct.  Each request gets one JSON line back, with
+# the same id and either "winPct" (for "state"), "winPcts" (for "states")
+# or "error".  runEnv must be positive and homeWin between 0 and 1.
+# Responses can come back in a different order than requests.
+#
+# Requests for the same runEnv and homeWin that arrive within batchDelay of
+# each other are answered together as one micro-batch.  Tables that have not
+# been solved yet are solved in an executor, so the event loop never blocks
+# on a solve.
+#
+# Usage: python WinExpServer.py [--host 127.0.0.1] [--port 8765]
+import argparse
+import asyncio
+import json
+import math
+from WinExp import WinExpCalculator, tableCache
+
+class WinExpService:
+
+  # maxBatch: number of queued states that flushes a micro-batch at once
+  # batchDelay: seconds to wait for more requests before answering a batch
+  # executor: concurrent.futures executor for cold solves (None for the
+  #     event loop's default executor)
+  def __init__(self,maxBatch=1024,batchDelay=.001,executor=None):
+    self.maxBatch = maxBatch
+    self.batchDelay = batchDelay
+    self.executor = executor
+    #queued (states, future) requests, the parameters they are for and
+    #their number of states, by tableCache key
+    self.queued = {}
+    self.queuedParams = {}
+    self.queuedStates = {}
+
+  # returns the win% for one state (a sequence of baseState, scoreDiff,
+  # inning, outs, half)
+  async def getWinPct(self,runEnv,homeWin,state):
+    return (await self.getWinPctBatch(runEnv,homeWin,[state]))[0]
+
+  # returns a list of win%s for a list of states
+  # Raises TypeError, before anything is queued, if states is not a list of
+  # 5 element lists.
+  async def getWinPctBatch(self,runEnv,homeWin,states):
+    if not (isinstance(states, (list, tuple)) and
+        all(isinstance(state, (list, tuple)) and len(state) == 5
+            for state in states)):
+      raise TypeError("states must be a list of [baseState, scoreDiff, " +
+          "inning, outs, half] lists")
+    count = len(states)
+    key = tableCache.key(runEnv,homeWin)
+    future = asyncio.get_running_loop().create_future()
+    if key not in self.queued:
+      self.queued[key] = []
+      self.queuedParams[key] = (runEnv, homeWin)
+      self.queuedStates[key] = 0
+      asyncio.get_running_loop().call_later(self.batchDelay, self.flush, key)
+    self.queued[key].append((states, future))
+    self.queuedStates[key] += count
+    if self.queuedStates[key] >= self.maxBatch:
+      self.flush(key)
+    return await future
+
+  # answers every request queued for key
+  def flush(self,key):
+    requests = self.queued.pop(key, None)
+    if requests is None:
+      return
+    del self.queuedStates[key]
+    #constructing a calculator is cheap, and it picks its table up from
+    #tableCache if it has been solved
+    try:
+      calc = WinExpCalculator(*self.queuedParams.pop(key))
+    except Exception as e:
+      self.fail(requests,e)
+      return
+    if calc.table is None:
+      asyncio.get_running_loop().create_task(self.solveAndAnswer(calc,requests))
+    else:
+      self.answer(calc,requests)
+
+  async def solveAndAnswer(self,calc,requests):
+    try:
+      await asyncio.get_running_loop().run_in_executor(self.executor,
+          calc.buildTable)
+    except Exception as e:
+      self.fail(requests,e)
+      return
+    self.answer(calc,requests)
+
+  # fails every request of a batch that has not been answered yet
+  def fail(self,requests,e):
+    for states, future in requests:
+      if not future.done():
+        future.set_exception(e)
+
+  # computes the results for a batch of requests on a solved calculator
+  def answer(self,calc,requests):
+    for states, future in requests:
+      if future.done():
+        continue
+      try:
+        future.set_result([calc.getWinPct(*state) for state in states])
+      except Exception as e:
+        future.set_exception(e)
+
+  # answers one decoded request; returns the response dict
+  async def handleRequest(self,request):
+    if not isinstance(request, dict):
+      return {"id": None, "error": "bad request: not a JSON object"}
+    response = {"id": request.get("id")}
+    try:
+      runEnv = float(request["runEnv"])
+      homeWin = float(request["homeWin"])
+      if not 0 < runEnv < math.inf:
+        raise ValueError("runEnv must be positive")
+      if not 0 < homeWin < 1:
+        raise ValueError("homeWin must be between 0 and 1")
+      if "states" in request:
+        response["winPcts"] = await self.getWinPctBatch(runEnv,homeWin,
+            request["states"])
+      else:
+        response["winPct"] = await self.getWinPct(runEnv,homeWin,
+            request["state"])
+    except (KeyError, TypeError, ValueError) as e:
+      response["error"] = type(e).__name__ + ": " + str(e)
+    return response
+
+  # serves one client connection
+  async def handleClient(self,reader,writer):
+    writeLock = asyncio.Lock()
+    tasks = set()
+    async def respond(line):
+      try:
+        request = json.loads(line)
+      except ValueError as e:
+        response = {"id": None, "error": "bad request: " + str(e)}
+      else:
+        try:
+          response = await self.handleRequest(request)
+        except Exception as e:
+          #every request gets an answer, whatever went wrong
+          response = {"id": request.get("id"), "error": type(e).__name__ +
+              ": " + str(e)}
+      async with writeLock:
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        if line.strip():
+          task = asyncio.get_running_loop().create_task(respond(line))
+          tasks.add(task)
+          task.add_done_callback(tasks.discard)
+      if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+      writer.close()
+
+  # starts listening; returns the asyncio Server
+  async def start(self,host="127.0.0.1",port=8765):
+    return await asyncio.start_server(self.handleClient, host, port)
+
+async def serve(host,port):
+  server = await WinExpService().start(host,port)
+  async with server:
+    await server.serve_forever()
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Win expectancy service")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8765)
+  args = parser.parse_args(argv)
+  asyncio.run(serve(args.host,args.port))
+
+if __name__ == "__main__":
+  main()
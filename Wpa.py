@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# Streams play-by-play files through GameState and WinExpCalculator and
+# scores every event with the win expectancy before and after it and the
+# win probability added (WPA, from the home team's point of view).
+#
+# Input files hold one play per line, one game after another, as either
+#   CSV:   a header row with "game" and "play" columns, then one row per play
+#   JSONL: one object per line, e.g. {"game": "BOS201504060", "play": "Walk"}
+# Plays use the names in GameState.playDict.  A new game starts whenever the
+# game id changes.  Plays that are not valid in the game state (such as a sac
+# fly with the bases empty) leave it as it is, and are reported on stderr.
+# Everything is done with generators, so files of any size are processed in
+# constant memory.
+#
+# scoreEventsParallel spreads whole games over a pool of processes that all
+# memory map one solved table, for season scale jobs.
+#
+# Usage: python Wpa.py events.csv [-o scored.csv] [--runEnv 4.5] [--homeWin .5]
+#            [--processes N]
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+from collections import namedtuple
+from Game import GameState
+from WinExp import WinExpCalculator, addCoefficients, openTable
+
+# One scored event
+#  game: id of the game the play belongs to
+#  event: number of the play within its game, starting at 1
+#  play: name of the play
+#  preWin, postWin: home team's win expectancy before and after the play
+#  wpa: postWin - preWin
+WpaEvent = namedtuple("WpaEvent", "game event play preWin postWin wpa")
+
+# reads (game, play) pairs from a CSV or JSONL play-by-play file
+# fmt: "csv" or "jsonl"; if None it is picked from the file extension
+def readEvents(path,fmt=None):
+  if fmt is None:
+    fmt = "jsonl" if path.endswith((".jsonl",".json")) else "csv"
+  with open(path, newline="") as f:
+    if fmt == "csv":
+      for row in csv.DictReader(f):
+        yield row["game"], row["play"]
+    elif fmt == "jsonl":
+      for line in f:
+        if line.strip():
+          obj = json.loads(line)
+          yield obj["game"], obj["play"]
+    else:
+      raise ValueError("readEvents: unknown format " + fmt)
+
+# replays (game, play) pairs and yields a WpaEvent for each one
+# events: iterable of (game, play) pairs, grouped by game
+# calc: WinExpCalculator used for the win expectancies
+def scoreEvents(events,calc):
+  lastGame = None
+  for game, play in events:
+    if game != lastGame:
+      lastGame = game
+      state = GameState()
+      eventNum = 0
+      postWin = calc.getWinPctByCode(state.getStateCode())
+    if play not in state.playDict:
+      raise ValueError("game " + str(game) + ": unknown play " + repr(play))
+    eventNum += 1
+    preWin = postWin
+    #invalid plays leave the state as it is; they are reported on stderr, so
+    #that only scored events reach stdout
+    message = state.checkPlay(play)
+    if message is None:
+      state.runPlay(play)
+    else:
+      print("game " + str(game) + ", event " + str(eventNum) + ": " +
+          message, file=sys.stderr)
+    postWin = calc.getWinPctByCode(state.getStateCode())
+    yield WpaEvent(game, eventNum, play, preWin, postWin, postWin - preWin)
+
+# groups (game, play) pairs into (game, [plays]) tuples, one game at a time
+def groupGames(events):
+  for game, plays in itertools.groupby(events, key=lambda event: event[0]):
+    yield game, [play for game, play in plays]
+
+# calculator of a scoreEventsParallel worker process, set up by initWorker
+workerCalc = None
+
+def initWorker(tablePath,coefficients,coeffPath):
+  global workerCalc
+  addCoefficients(coefficients,coeffPath)
+  workerCalc = openTable(tablePath,coefficients=coefficients)
+
+# scores one (game, [plays]) tuple in a worker process
+def scoreGame(game):
+  gameId, plays = game
+  return list(scoreEvents(((gameId, play) for play in plays), workerCalc))
+
+# same as scoreEvents, but with whole games spread over a pool of processes
+# Every worker memory maps the same solved table instead of solving its own,
+# and results come back in input order.  Games are handed out in windows of
+# at most window games, so memory stays bounded for any input size.
+# Variables:
+#  events: iterable of (game, play) pairs, grouped by game
+#  calc: WinExpCalculator used for the win expectancies
+#  processes: number of worker processes (default: one per CPU)
+#  window: number of games in flight at once
+def scoreEventsParallel(events,calc,processes=None,window=4096):
+  fd, tablePath = tempfile.mkstemp(suffix=".tbl")
+  os.close(fd)
+  try:
+    calc.saveTable(tablePath)
+    with multiprocessing.Pool(processes, initializer=initWorker,
+        initargs=(tablePath, calc.coefficients, calc.coeffSet.path)) as pool:
+      games = groupGames(events)
+      chunk = max(1, window//(4*(processes or os.cpu_count() or 1)))
+      while True:
+        batch = list(itertools.islice(games, window))
+        if not batch:
+          break
+        for scored in pool.imap(scoreGame, batch, chunk):
+          yield from scored
+  finally:
+    os.remove(tablePath)
+
+# writes scored events to a file object as CSV
+def writeEvents(scored,out):
+  writer = csv.writer(out)
+  writer.writerow(WpaEvent._fields)
+  for event in scored:
+    writer.writerow(event)
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+      description="Score play-by-play files with win probability added")
+  parser.add_argument("path", help="CSV or JSONL play-by-play file")
+  parser.add_argument("-o", "--output", help="output CSV (default stdout)")
+  parser.add_argument("--format", choices=("csv","jsonl"),
+      help="input format (default: from the file extension)")
+  parser.add_argument("--runEnv", type=float, default=4.5)
+  parser.add_argument("--homeWin", type=float, default=.5)
+  parser.add_argument("--processes", type=int, default=1,
+      help="worker processes to spread games over (0: one per CPU)")
+  args = parser.parse_args(argv)
+  calc = WinExpCalculator(args.runEnv,args.homeWin)
+  events = readEvents(args.path,args.format)
+  if args.processes == 1:
+    scored = scoreEvents(events,calc)
+  else:
+    scored = scoreEventsParallel(events,calc,args.processes or None)
+  if args.output is None:
+    writeEvents(scored,sys.stdout)
+  else:
+    with open(args.output, "w", newline="") as out:
+      writeEvents(scored,out)
+
+if __name__ == "__main__":
+  main()